@@ -0,0 +1,65 @@
+"""Benchmarks for yidashcam
+
+Run all with: python -m benchmarks [-o FILE] [-c BASELINE]
+or individually with: python -m benchmarks.<name> [--json FILE]"""
+
+import datetime
+import json
+import platform
+from collections import namedtuple
+
+import yidashcam
+
+
+class Result(namedtuple('Result',
+                        ['benchmark', 'name', 'value', 'unit', 'higher'])):
+    """Benchmark measurement; `higher` if higher values are better"""
+    __slots__ = ()
+
+
+def percentile(values, fraction):
+    """Value at `fraction` (0 to 1) through sorted `values`"""
+    values = sorted(values)
+    return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+def latency_results(benchmark, name, latencies, elapsed=None):
+    """Results for mean, median and 95th percentile of `latencies` (seconds)
+
+    Plus rate, if `elapsed` time for them all is given"""
+    results = [
+        Result(benchmark, "{} mean".format(name),
+               1000 * sum(latencies) / len(latencies), "ms", False),
+        Result(benchmark, "{} p50".format(name),
+               1000 * percentile(latencies, 0.5), "ms", False),
+        Result(benchmark, "{} p95".format(name),
+               1000 * percentile(latencies, 0.95), "ms", False),
+    ]
+    if elapsed is not None:
+        results.append(Result(benchmark, "{} rate".format(name),
+                              len(latencies) / elapsed, "/s", True))
+    return results
+
+
+def add_json_argument(parser):
+    parser.add_argument('--json', metavar="FILE",
+                        help="also write results as JSON to FILE")
+
+
+def write_json(results, path):
+    """Write `results`, with details of environment, as JSON to `path`"""
+    document = {
+        'version': yidashcam.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': datetime.datetime.now().replace(microsecond=0).isoformat(),
+        'results': [result._asdict() for result in results],
+    }
+    with open(path, 'w') as json_file:
+        json.dump(document, json_file, indent=2)
+
+
+def read_json(path):
+    """Read results written by `write_json`"""
+    with open(path) as json_file:
+        return [Result(**result) for result in json.load(json_file)['results']]
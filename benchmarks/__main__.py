@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""Run all benchmarks, optionally comparing with results from before"""
+
+import argparse
+
+from . import read_json, write_json
+from . import bench_commands, bench_download, bench_file_list, bench_webapp
+
+#: Benchmarks, with settings to run them reasonably quickly
+BENCHMARKS = [
+    (bench_commands, {'count': 500, 'latency': 0.002}),
+    (bench_file_list, {'counts': (10000, 50000)}),
+    (bench_download, {'size': 16000000, 'repeat': 2, 'bandwidth': 20e6}),
+    (bench_webapp, {'files': 2000, 'requests_count': 200}),
+]
+
+
+def compare(result, baseline):
+    """Change from `baseline` to `result`, as string with "+" if better"""
+    if not baseline.value:
+        return ""
+    change = (result.value - baseline.value) / baseline.value
+    better = change > 0 if result.higher else change < 0
+    return "{:+.1%}{}".format(change, " +" if better else "")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', dest='output', metavar="FILE",
+                        help="write results as JSON to FILE")
+    parser.add_argument('-c', dest='baseline', metavar="BASELINE",
+                        help="compare with JSON results in BASELINE")
+    parser.add_argument('names', metavar="NAME", nargs='*',
+                        help="benchmarks to run (default: all)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        baseline = {(result.benchmark, result.name): result
+                    for result in read_json(args.baseline)}
+
+    results = []
+    for module, settings in BENCHMARKS:
+        name = module.__name__.rpartition('.bench_')[2]
+        if args.names and name not in args.names:
+            continue
+        print("{}:".format(name), flush=True)
+        for result in module.run(**settings):
+            results.append(result)
+            before = baseline.get((result.benchmark, result.name))
+            print("  {0.name:<32} {0.value:10.2f} {0.unit:<5} {1}".format(
+                result, compare(result, before) if before else ""),
+                flush=True)
+
+    if args.output:
+        write_json(results, args.output)
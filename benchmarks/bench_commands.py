@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Command round-trip latency, with and without a keep-alive session
+
+Compares `YIDashcam` against sending the same commands with a bare
+`requests.get`, as `YIDashcam` did prior to using a persistent session.
+"""
+
+import argparse
+import time
+from collections import OrderedDict
+
+import requests
+
+from yidashcam import Command, YIDashcam
+from yidashcam.simulator import SimulatedCamera
+
+from . import add_json_argument, latency_results, write_json
+
+
+def timed(func, count):
+    """Latency of `count` calls to `func`, and total time taken"""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(count):
+        sent = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - sent)
+    return latencies, time.perf_counter() - start
+
+
+def bench_bare(camera, count):
+    url = "http://{0.host}:{0.port}/".format(camera)
+    requests.get(url, params=OrderedDict(
+        [('custom', 1), ('cmd', int(Command.connect))]), timeout=5)
+    params = OrderedDict([('custom', 1), ('cmd', int(Command.video_state))])
+    return timed(
+        lambda: requests.get(url, params=params, timeout=5).raise_for_status(),
+        count)
+
+
+def bench_session(camera, count):
+    with YIDashcam(**camera.kwargs) as yi:
+        return timed(lambda: yi.recording, count)
+
+
+def run(count=1000, latency=0):
+    """Results for `count` commands to a camera with `latency` seconds"""
+    with SimulatedCamera(latency=latency) as camera:
+        return (latency_results("commands", "requests.get",
+                                *bench_bare(camera, count))
+                + latency_results("commands", "YIDashcam",
+                                  *bench_session(camera, count)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', dest='count', type=int, default=1000,
+                        help="number of commands to send (default: 1000)")
+    parser.add_argument('-l', dest='latency', type=float, default=0,
+                        help="simulated camera latency in ms (default: 0)")
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.count, args.latency / 1000)
+    for result in results:
+        print("{0.name:<24} {0.value:10.2f} {0.unit}".format(result))
+    if args.json:
+        write_json(results, args.json)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Download throughput from a simulated camera
+
+Compares `YIDashcam.save_file` against writing chunks from
+`YIDashcam.get_file`, with 1 KiB chunks (as previously used) and the
+current default chunk size, and `YIDashcam.download_files` fetching several
+files at once.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from yidashcam import Mode, STREAM_CHUNK_SIZE, YIDashcam
+from yidashcam.simulator import SimulatedCamera, synthetic_files
+
+from . import Result, add_json_argument, write_json
+
+
+def bench(func, size, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        with open(os.devnull, 'wb') as dest:
+            start = time.perf_counter()
+            func(dest)
+            best = min(best, time.perf_counter() - start)
+    return size / best / 1e6
+
+
+def run(size=64000000, repeat=3, files=4, latency=0, bandwidth=None):
+    """Results for `size` byte file(s), best of `repeat` attempts
+
+    `files` of `size` bytes are used for `YIDashcam.download_files`"""
+    with SimulatedCamera(files=synthetic_files(files, size), latency=latency,
+                         bandwidth=bandwidth) as camera, \
+            YIDashcam(Mode.file, **camera.kwargs) as yi:
+        file_list = yi.roadmap_list + yi.emergency_list
+        file = file_list[0]
+
+        def get_file(chunk_size):
+            def func(dest):
+                for data in yi.get_file(file, chunk_size=chunk_size):
+                    dest.write(data)
+            return func
+
+        results = [
+            ("get_file (1 KiB chunks)", get_file(1024)),
+            ("get_file (default chunks)", get_file(STREAM_CHUNK_SIZE)),
+            ("save_file", lambda dest: yi.save_file(file, dest)),
+        ]
+        results = [Result("download", name, bench(func, size, repeat),
+                          "MB/s", True)
+                   for name, func in results]
+
+        best = float('inf')
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as dest_dir:
+                start = time.perf_counter()
+                yi.download_files(file_list, dest_dir)
+                best = min(best, time.perf_counter() - start)
+        results.append(Result(
+            "download", "download_files ({} files)".format(len(file_list)),
+            size * len(file_list) / best / 1e6, "MB/s", True))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-s', dest='size', type=int, default=64,
+                        help="size of file in MB (default: 64)")
+    parser.add_argument('-r', dest='repeat', type=int, default=3,
+                        help="repeats, best of which is reported (default: 3)")
+    parser.add_argument('-l', dest='latency', type=float, default=0,
+                        help="simulated camera latency in ms (default: 0)")
+    parser.add_argument('-b', dest='bandwidth', type=float,
+                        help="simulated camera bandwidth in MB/s "
+                             "(default: unlimited)")
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.size * 1000000, args.repeat,
+                  latency=args.latency / 1000,
+                  bandwidth=args.bandwidth and args.bandwidth * 1e6)
+    for result in results:
+        print("{0.name:<30} {0.value:8.1f} {0.unit}".format(result))
+    if args.json:
+        write_json(results, args.json)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""File list parse time and memory for synthetic SD Card listings
+
+Compares the streaming parser used by `YIDashcam.iter_files` against
+building a full ElementTree and parsing times with `strptime`, as
+`YIDashcam.file_list` did previously.
+"""
+
+import argparse
+import datetime
+import time
+import tracemalloc
+from collections import namedtuple
+from xml.etree import ElementTree as ET
+
+from yidashcam import CATEGORIES, FILE_LIST_CHUNK_SIZE, _iter_file_list_xml
+
+from . import Result, add_json_argument, write_json
+
+_FOLDERS = (("Movie", 32), ("Movie_s", 32), ("EMR", 33), ("Photo", 32))
+
+OldFile = namedtuple('OldFile', ['name', 'path', 'size', 'time', 'read_only'])
+
+
+def synthetic_listing(count):
+    """XML file listing of `count` files spread across the folders"""
+    start = datetime.datetime(2020, 1, 1)
+    entries = []
+    for index in range(count):
+        folder, attr = _FOLDERS[index % len(_FOLDERS)]
+        name = "{:%Y_%m%d_%H%M%S}_{:03d}.MP4".format(
+            start + datetime.timedelta(minutes=index), index % 1000)
+        entries.append(
+            "<File><NAME>{0}</NAME><FPATH>A:\\{1}\\{0}</FPATH>"
+            "<SIZE>{2}</SIZE><TIMECODE>0</TIMECODE>"
+            "<TIME>{3:%Y/%m/%d %H:%M:%S}</TIME><ATTR>{4}</ATTR></File>\n"
+            .format(name, folder, 100000000 + index,
+                    start + datetime.timedelta(minutes=index), attr))
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n<LIST>\n<ALLFile>\n'
+            '{}</ALLFile>\n</LIST>\n').format("".join(entries)).encode()
+
+
+def parse_old(listing):
+    files_et = ET.fromstring(listing.decode())
+    files = [
+        OldFile(
+            file.find("NAME").text, file.find("FPATH").text,
+            int(file.find("SIZE").text), datetime.datetime.strptime(
+                file.find("TIME").text, "%Y/%m/%d %H:%M:%S"),
+            bool(int(file.find("ATTR").text) & 1))
+        for file in files_et.iter("File")
+    ]
+    categories = (
+        [file for file in files.copy() if "movie" in file.path.lower()],
+        [file for file in files.copy() if "emr" in file.path.lower()],
+        [file for file in files.copy() if "photo" in file.path.lower()],
+    )
+    return files, categories
+
+
+def parse_new(listing):
+    chunks = (listing[i:i + FILE_LIST_CHUNK_SIZE]
+              for i in range(0, len(listing), FILE_LIST_CHUNK_SIZE))
+    files = list(_iter_file_list_xml(chunks))
+    categories = {category: [] for category in CATEGORIES}
+    for file in files:
+        categories[file.category].append(file)
+    return files, categories
+
+
+def measure(func, listing):
+    start = time.perf_counter()
+    func(listing)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    result = func(listing)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del result
+    return elapsed, peak
+
+
+def run(counts=(10000, 50000, 100000)):
+    """Results for listings of each of `counts` files"""
+    results = []
+    for count in counts:
+        listing = synthetic_listing(count)
+        for name, func in (("old", parse_old), ("new", parse_new)):
+            elapsed, peak = measure(func, listing)
+            results.append(Result(
+                "file_list", "{} {} files".format(name, count),
+                elapsed, "s", False))
+            results.append(Result(
+                "file_list", "{} {} files peak memory".format(name, count),
+                peak / 1e6, "MB", False))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('counts', metavar="COUNT", type=int, nargs='*',
+                        default=[10000, 50000, 100000],
+                        help="number of files in listing")
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.counts)
+    values = iter(result.value for result in results)
+    print("{:>8} {:>10} {:>10} {:>8} {:>10} {:>10}".format(
+        "files", "old (s)", "new (s)", "speed up", "old (MB)", "new (MB)"))
+    for count in args.counts:
+        old_time, old_peak, new_time, new_peak = [
+            next(values) for _ in range(4)]
+        print("{:8d} {:10.3f} {:10.3f} {:7.2f}x {:10.1f} {:10.1f}".format(
+            count, old_time, new_time, old_time / new_time, old_peak,
+            new_peak))
+    if args.json:
+        write_json(results, args.json)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""Webapp page and thumbnail latency under concurrent clients
+
+Serves the webapp, backed by a simulated camera, on a local port, and
+requests file list pages, thumbnails not yet cached (cold) and the same
+thumbnails again (warm) from several clients at once.
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import tempfile
+import threading
+import time
+
+import requests
+from werkzeug.serving import make_server
+
+from yidashcam import Mode, YIDashcam
+from yidashcam import webapp
+from yidashcam.simulator import SimulatedCamera, synthetic_files
+
+from . import add_json_argument, latency_results, write_json
+
+
+def fetch_all(base_url, paths, clients):
+    """Latency of fetching each of `paths` using `clients` concurrently,
+    and total time taken"""
+    local = threading.local()
+
+    def fetch(path):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        start = time.perf_counter()
+        session.get(base_url + path, timeout=60).raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(clients) as executor:
+        latencies = list(executor.map(fetch, paths))
+    return latencies, time.perf_counter() - start
+
+
+def run(files=2000, clients=8, requests_count=200, latency=0.005,
+        prefetch=False):
+    """Results for a card of `files`, with `clients` making
+    `requests_count` requests of each kind"""
+    with SimulatedCamera(files=synthetic_files(files, 1000),
+                         latency=latency) as camera, \
+            tempfile.TemporaryDirectory() as cache_dir, \
+            YIDashcam(Mode.file, **camera.kwargs) as yi:
+        webapp.app.config['THUMBNAIL_CACHE_DIR'] = cache_dir
+        webapp.app.config['THUMBNAIL_PREFETCH'] = prefetch
+        webapp.thumbnail_cache = None
+        webapp.yi = yi
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, webapp.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = "http://127.0.0.1:{}".format(server.server_port)
+        try:
+            pages = max(len(yi.roadmap_list) // 20, 1)
+            page_paths = ["/roadmap/{}".format(index % pages + 1)
+                          if index % pages else "/roadmap/"
+                          for index in range(requests_count)]
+            thumbnail_paths = ["/thumbnail{}".format(file.url_path)
+                               for file in yi.latest(requests_count)]
+            results = latency_results(
+                "webapp", "page", *fetch_all(base_url, page_paths, clients))
+            results += latency_results(
+                "webapp", "thumbnail cold",
+                *fetch_all(base_url, thumbnail_paths, clients))
+            results += latency_results(
+                "webapp", "thumbnail warm",
+                *fetch_all(base_url, thumbnail_paths, clients))
+        finally:
+            server.shutdown()
+            webapp.yi = None
+            webapp.thumbnail_cache = None
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-f', dest='files', type=int, default=2000,
+                        help="number of files on card (default: 2000)")
+    parser.add_argument('-c', dest='clients', type=int, default=8,
+                        help="concurrent clients (default: 8)")
+    parser.add_argument('-n', dest='count', type=int, default=200,
+                        help="requests of each kind (default: 200)")
+    parser.add_argument('-l', dest='latency', type=float, default=5,
+                        help="simulated camera latency in ms (default: 5)")
+    parser.add_argument('-p', dest='prefetch', action='store_true',
+                        help="enable thumbnail prefetching")
+    add_json_argument(parser)
+    args = parser.parse_args()
+    results = run(args.files, args.clients, args.count, args.latency / 1000,
+                  args.prefetch)
+    for result in results:
+        print("{0.name:<24} {0.value:10.2f} {0.unit}".format(result))
+    if args.json:
+        write_json(results, args.json)
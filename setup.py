@@ -26,9 +26,11 @@ setup(
     ],
     keywords='xiaomi yi dashcam',
     packages=['yidashcam'],
+    python_requires='>=3.4',
     install_requires=['requests'],
     extras_require={
         'webapp': ['Flask-Bootstrap'],
+        'async': ['aiohttp>=3.3'],
     },
     package_data={
         'yidashcam': ['templates/*.html'],
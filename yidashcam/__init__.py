@@ -3,21 +3,32 @@
 __author__ = "Steven Hiscocks"
 __version__ = "0.8"
 
+import concurrent.futures
 import datetime
 import enum
+import http.client
+import itertools
+import json
 import logging
 import ntpath
+import os
+import random
 import re
 import socket
 import threading
 import time
 import weakref
-from collections import namedtuple, OrderedDict
+from collections import Counter, namedtuple, OrderedDict
 from xml.etree import ElementTree as ET
 
 import requests
+import requests.adapters
+import urllib3
 
 from . import config
+from .heartbeat import Heartbeat, Health
+from .index import FileIndex
+from .scheduler import CommandScheduler, Priority
 
 _LOG = logging.getLogger(__name__)
 
@@ -34,6 +45,30 @@ class YIDashcamFileException(YIDashcamException):
     """Exception for file errors with dashcam"""
 
 
+class YIDashcamDownloadException(YIDashcamFileException):
+    """Exception for failure to download one or more files from dashcam
+
+    `downloaded` maps files successfully downloaded to their local path, and
+    `failed` maps files which failed to the exception raised."""
+
+    def __init__(self, message, downloaded, failed):
+        super().__init__(message)
+        self.downloaded = downloaded
+        self.failed = failed
+
+
+class YIDashcamDeleteException(YIDashcamFileException):
+    """Exception for failure to delete one or more files from dashcam
+
+    `deleted` is a list of paths successfully deleted, and `failed` maps
+    paths which failed to the exception raised."""
+
+    def __init__(self, message, deleted, failed):
+        super().__init__(message)
+        self.deleted = deleted
+        self.failed = failed
+
+
 @enum.unique
 class Command(enum.IntEnum):
     """Dashcam commands"""
@@ -57,6 +92,100 @@ class Command(enum.IntEnum):
     video_stream = 2015  # par=0 or 1 to toggle off and on
 
 
+#: Default timeouts, in seconds, for each class of command. Values can either
+#: be a single timeout or a (connect, read) tuple, as accepted by `requests`.
+#: The read timeout applies between bytes received, so "transfer" need not
+#: allow for the size of the file.
+DEFAULT_TIMEOUTS = {
+    'command': 5,
+    'listing': 15,
+    'thumbnail': 10,
+    'transfer': (5, 30),
+}
+
+#: Interval, in seconds, between heartbeats sent to keep connection alive
+HEARTBEAT_INTERVAL = 10
+
+#: Interval, in seconds, between attempts to automatically reconnect
+RECONNECT_INTERVAL = 2
+
+#: Time, in seconds, after losing connection within which reconnecting keeps
+#: the cached config and file list
+RECONNECT_KEEP_CACHE = 60
+
+#: Time, in seconds, to wait for dashcam to accept commands after changing
+#: mode or stopping recording, and interval between attempts
+READY_TIMEOUT = 10
+READY_POLL_INTERVAL = 0.1
+
+#: Default size of chunks, in bytes, yielded by `YIDashcam.get_file` and
+#: `YIDashcam.get_thumbnail`
+STREAM_CHUNK_SIZE = 64 * 1024
+
+#: Size of buffer, in bytes, read into and written from when saving files
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+_COMMAND_TIMEOUT_CLASS = {
+    Command.config: 'listing',
+    Command.file_list: 'listing',
+    Command.file_thumbnail: 'thumbnail',
+    Command.file_get: 'transfer',
+}
+
+#: Commands which may have an effect each time they're received, so are only
+#: retried if they can't have reached the dashcam
+_NON_IDEMPOTENT_COMMANDS = frozenset({
+    Command.file_delete,
+    Command.file_force_delete,
+    Command.take_photo,
+    Command.video_emergency,
+    Command.video_photo,
+})
+
+#: Read-only commands, identical concurrent requests of which are merged
+_SINGLE_FLIGHT_COMMANDS = frozenset({
+    Command.card_info,
+    Command.config,
+    Command.video_state,
+})
+
+
+class RetryPolicy(
+        namedtuple('RetryPolicy',
+                   ['attempts', 'backoff', 'max_backoff', 'jitter',
+                    'budget'])):
+    """Policy for retrying requests to dashcam after transient failures
+
+    Requests are made up to `attempts` times, waiting `backoff` seconds after
+    the first failure, doubling after each further failure up to
+    `max_backoff`, and randomly varied by up to `jitter` (as a fraction) so
+    concurrent requests don't retry in step. No retry is made which would
+    start more than `budget` seconds after the first attempt."""
+    __slots__ = ()
+
+    def delay(self, retry):
+        """Time, in seconds, to wait before retry number `retry` (from 0)"""
+        delay = min(self.backoff * 2 ** retry, self.max_backoff)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+#: Default `RetryPolicy` for requests to the dashcam
+DEFAULT_RETRY_POLICY = RetryPolicy(
+    attempts=3, backoff=0.25, max_backoff=2, jitter=0.5, budget=10)
+
+#: `RetryPolicy` to make requests only once
+NO_RETRY = RetryPolicy(attempts=1, backoff=0, max_backoff=0, jitter=0,
+                       budget=0)
+
+
+def _not_sent(err):
+    """Whether request failed with `err` can't have reached the dashcam"""
+    if isinstance(err, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], 'reason', None) if err.args else None
+    return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+
 @enum.unique
 class Mode(enum.IntEnum):
     """Dashcam modes"""
@@ -65,10 +194,60 @@ class Mode(enum.IntEnum):
     file = 2
 
 
+#: File categories, each corresponding to a folder on the SD Card
+CATEGORIES = ('roadmap', 'emergency', 'photo')
+
+#: Size of chunks, in bytes, read when streaming the file list
+FILE_LIST_CHUNK_SIZE = 64 * 1024
+
+
+def _file_category(path):
+    """Category of file, based on folder of `path` on SD Card"""
+    path = path.lower()
+    if "movie" in path:
+        return 'roadmap'
+    elif "emr" in path:
+        return 'emergency'
+    elif "photo" in path:
+        return 'photo'
+    return None
+
+
+def _parse_time(time_str):
+    """Parse dashcam time string, much faster than `strptime`"""
+    try:
+        return datetime.datetime(
+            int(time_str[0:4]), int(time_str[5:7]), int(time_str[8:10]),
+            int(time_str[11:13]), int(time_str[14:16]), int(time_str[17:19]))
+    except ValueError:
+        return datetime.datetime.strptime(time_str, "%Y/%m/%d %H:%M:%S")
+
+
+_NAME_TIME_RE = re.compile(r"(\d{4})_(\d\d)(\d\d)_(\d\d)(\d\d)(\d\d)_")
+
+
+def _name_time(name):
+    """Time from dashcam file `name` (e.g. "2017_0131_235959_0001.JPG"),
+    taken from the dashcam's clock, or `None` if not in name"""
+    match = _NAME_TIME_RE.match(name)
+    if match is None:
+        return None
+    try:
+        return datetime.datetime(*(int(group) for group in match.groups()))
+    except ValueError:
+        return None
+
+
 class YIDashcamFile(
         namedtuple('YIDashcamFile',
                    ['name', 'path', 'size', 'time', 'read_only'])):
     """Dashcam File properties"""
+    __slots__ = ()
+
+    @property
+    def category(self):
+        """One of `CATEGORIES`, from folder of `path` (`None` if unknown)"""
+        return _file_category(self.path)
 
     @property
     def url_path(self):
@@ -81,20 +260,359 @@ class YIDashcamFile(
         return ntpath.splitdrive(path)[1].replace("\\", "/")
 
 
+class DownloadProgress(
+        namedtuple('DownloadProgress',
+                   ['file', 'file_bytes', 'file_rate', 'total_bytes',
+                    'total_size', 'total_rate'])):
+    """Progress of a bulk download
+
+    `file_bytes` and `file_rate` (bytes per second) are for `file`, with
+    `total_bytes`, `total_size` and `total_rate` across all files."""
+
+    @property
+    def file_done(self):
+        """Whether `file` has been completely downloaded"""
+        return self.file_bytes >= self.file.size
+
+
+def _command_params(cmd, par=None, **kwargs):
+    """URL query parameters for command `cmd`"""
+    params = OrderedDict()  # Order of parameters is important
+    if cmd >= 0:
+        params['custom'] = 1  # Must be first!
+        params['cmd'] = int(cmd)
+    if par is not None:
+        params['par'] = int(par)
+    params.update(kwargs)
+    return params
+
+
+def _parse_cmd_response(cmd, path, content_type, text):
+    """Parse response body `text` to command `cmd` for `path`"""
+    if content_type == "text/xml":
+        value = _parse_response(cmd, ET.fromstring(text))
+        if value is not None:
+            return value
+    elif content_type == "text/html":
+        res_html = ET.fromstring(text)
+        res_title = res_html.find("head/title")
+        if res_title is not None \
+                and res_title.text.lower() == "page not found":
+            # Doesn't raise expected 404 in HTTP code
+            raise YIDashcamFileException("File not found {}".format(path))
+    return text
+
+
+def _parse_card_info(text):
+    """Parse SD Card information response"""
+    info_et = ET.fromstring(text)
+    return {
+        'type': info_et.find('CARDTYPE').text,
+        'write_rate': int(info_et.find('CARDWRITERATE').text),
+        'capacity': int(info_et.find('CARDCAPACITY').text),
+        'vendor': int(info_et.find('CARDVENDOR').text),
+        'slow_card': bool(int(info_et.find('CTNSLOWCARD').text)),
+        'average_use_duration': int(info_et.find('AVGUSEDUR').text),
+        'total_use': int(info_et.find('CTNTOTALUSE').text),
+        # 'LDW': int(info_et.find('CTNLDW').string),
+        # 'FCW': int(info_et.find('CTNFCW').string),
+    }
+
+
+def _parse_config(text):
+    """Parse config response, to dict of options to values"""
+    config_values = {}
+    config_et = ET.fromstring(text)
+    for cmd_et, status_et in zip(
+            config_et.iter('Cmd'), config_et.iter('Status')):
+        try:
+            option = config.Option(int(cmd_et.text))
+        except ValueError:
+            _LOG.debug("Config option %s not recognised", cmd_et.text)
+        else:
+            try:
+                value = int(status_et.text)
+            except ValueError:
+                value = status_et.text
+            config_values[option] = config.option_map[option](value)
+    return config_values
+
+
+def _config_value(option, value):
+    """Validate and convert `value` for config `option`"""
+    try:
+        return config.option_map[option](value)
+    except KeyError:
+        raise ValueError("Not a valid config option: {}".format(option))
+    except ValueError:
+        raise ValueError("Invalid value for config option: {}: {}".format(
+            option, value))
+
+
+def _parse_response(cmd, res_xml):
+    """Parse XML response to command `cmd`
+
+    Returns `None` if not a response to `cmd`"""
+    res_cmd = res_xml.find("Cmd")
+    res_status = res_xml.find("Status")
+    if res_cmd is None or int(res_cmd.text) != cmd or res_status is None:
+        return None
+    status = int(res_status.text)
+    if status == -256:
+        raise YIDashcamConnectionException("Lost connection")
+    elif status < 0:
+        raise YIDashcamException("Bad status returned: {}".format(status))
+    res_str = res_xml.find("String")
+    if res_str is not None:
+        return res_str.text
+    res_value = res_xml.find("Value")
+    if res_value is not None:
+        return res_value.text
+    return res_status.text
+
+
+class _FileListTarget():
+    """Parser target building `YIDashcamFile` from file list XML elements
+
+    Only the text of each element is kept, rather than building a tree."""
+
+    def __init__(self):
+        self.files = []
+        self.depth = 0
+        self.fields = {}
+        self.text = []
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        self.text.clear()
+
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, tag):
+        self.depth -= 1
+        fields = self.fields
+        if tag == "File":
+            self.files.append(YIDashcamFile(
+                fields["NAME"], fields["FPATH"], int(fields["SIZE"]),
+                _parse_time(fields["TIME"]), bool(int(fields["ATTR"]) & 1)))
+            fields.clear()
+        elif self.depth == 0:
+            if tag != "LIST":
+                # Not a listing, so should be a command status
+                res_xml = ET.Element(tag)
+                for field_tag, text in fields.items():
+                    ET.SubElement(res_xml, field_tag).text = text
+                _parse_response(Command.file_list, res_xml)
+        else:
+            fields[tag] = "".join(self.text)
+
+    def close(self):
+        pass
+
+
+class _FileListParser():
+    """Incremental parser of file list XML"""
+
+    def __init__(self):
+        self._target = _FileListTarget()
+        self._parser = ET.XMLParser(target=self._target)
+
+    def _files(self):
+        files = self._target.files
+        self._target.files = []
+        return files
+
+    def feed(self, data):
+        """Parse `data` bytes, returning list of files now complete"""
+        self._parser.feed(data)
+        return self._files()
+
+    def close(self):
+        """Finish parsing, returning list of any remaining files"""
+        self._parser.close()
+        return self._files()
+
+
+def _iter_file_list_xml(chunks):
+    """Parse file list XML from iterable of `chunks` of bytes
+
+    Files are yielded as they are parsed, so the whole listing is never held
+    in memory at once."""
+    parser = _FileListParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+def _chunk_range(chunk, offset, start, end=None):
+    """Part of `chunk` of bytes at `offset` in range `start` to `end`
+    inclusive, and whether the end of the range has been reached"""
+    if end is not None and offset + len(chunk) > end:
+        return chunk[max(start - offset, 0):end + 1 - offset], True
+    return chunk[max(start - offset, 0):], False
+
+
+def _byte_range(chunks, start, end=None):
+    """Limit iterable of `chunks` of bytes to range `start` to `end`
+    inclusive"""
+    offset = 0
+    for chunk in chunks:
+        data, done = _chunk_range(chunk, offset, start, end)
+        offset += len(chunk)
+        if data:
+            yield data
+        if done:
+            return
+
+
+def _write_response(res, dest, chunk_size, callback=None):
+    """Write body of streamed response `res` to file object `dest`
+
+    Data is read into a single reused buffer of `chunk_size` bytes, and
+    `callback` (if given) called with the size of each chunk written.
+
+    Returns number of bytes written"""
+    buffer = memoryview(bytearray(chunk_size))
+    written = 0
+    if hasattr(res.raw, '_fp') \
+            and res.headers.get('content-encoding', 'identity') == 'identity':
+        # Read from underlying `http.client` response, as `urllib3` copies
+        # data when reading into a buffer
+        reader = res.raw._fp
+    else:
+        res.raw.decode_content = True
+        reader = res.raw
+    try:
+        while True:
+            size = reader.readinto(buffer)
+            if not size:
+                break
+            dest.write(buffer[:size])
+            written += size
+            if callback is not None:
+                callback(size)
+    except (http.client.HTTPException, urllib3.exceptions.HTTPError,
+            requests.exceptions.RequestException, ConnectionError,
+            socket.timeout) as err:
+        raise YIDashcamException("Transfer failed: {}".format(err))
+    length = res.headers.get('content-length')
+    if reader is not res.raw and length is not None and int(length) != written:
+        raise YIDashcamException("Transfer ended early")
+    return written
+
+
+def _weak_callback(method):
+    """Callback to bound `method`, which doesn't keep its instance alive"""
+    method = weakref.WeakMethod(method)
+
+    def callback(*args):
+        func = method()
+        if func is not None:
+            func(*args)
+    return callback
+
+
+def _companion_path(path):
+    """Path of the low resolution "_s" clip recorded alongside a roadmap clip
+
+    Returns `None` if `path` isn't a roadmap clip"""
+    if "movie" not in path.lower() or "movie_s" in path.lower():
+        return None
+    return re.sub(r"^(.+movie)(.+)(\..{3})$", "\\1_s\\2_s\\3", path,
+                  flags=re.IGNORECASE)
+
+
+def _delete_order(files, file_index):
+    """List of (path, main path) to delete `files` (or paths)
+
+    Roadmap clips are followed by their "_s" companion, if in `file_index`,
+    with the main clip's path; otherwise this is `None`."""
+    deletes = OrderedDict()
+    for file in files:
+        try:
+            path = file.path
+        except AttributeError:
+            path = file
+        deletes.setdefault(path, None)
+        companion = file_index.get(_companion_path(path) or "")
+        if companion is not None:
+            deletes.setdefault(companion.path, path)
+    return list(deletes.items())
+
+
 class YIDashcam():
-    """Class to interact with Xiaomi YI Dashcam"""
+    """Class to interact with Xiaomi YI Dashcam
+
+    Commands are sent over a persistent HTTP session, keeping up to
+    `pool_size` connections to the dashcam alive between commands. `timeouts`
+    can be used to override any of the `DEFAULT_TIMEOUTS`. Requests which
+    fail due to connection problems or server errors are retried according
+    to `retry_policy` (default: `DEFAULT_RETRY_POLICY`), except those which
+    aren't safe to repeat, unless they can't have reached the dashcam. Number
+    of retries made for each command are counted in `retry_counts`.
+
+    If `metrics` (a `yidashcam.metrics.Metrics`) is given, latency, errors,
+    transfers and cache use are recorded to it.
+
+    Instances can be shared between threads. Commands are serialized, as the
+    dashcam only handles one at a time, with those sent at
+    `Priority.interactive` ahead of any at `Priority.background` (see
+    `priority`). File data is transferred concurrently, once requested.
+
+    The connection is monitored by heartbeats (see `health`), and
+    `health_callback` called with the new `Health` whenever it changes (note
+    this may be from another thread). If `auto_reconnect`, the dashcam is
+    reconnected to in the background if the connection is lost, returning to
+    the mode it was in.
+
+    If `snapshot` (a `yidashcam.snapshot.SnapshotStore`) is given, the file
+    list is saved to it, and on connecting is loaded from it instead of
+    fetched, if the SD Card info shows the card unchanged. The config is
+    still fetched, for the dashcam's serial number. The card info check is
+    also used to keep the cached file list when changing to "file" mode."""
     HOST = "192.168.1.254"
-
-    def __init__(self, mode=Mode.video):
+    PORT = 80
+    HEARTBEAT_PORT = 3333
+
+    def __init__(self, mode=Mode.video, host=None, port=None,
+                 heartbeat_port=None, pool_size=4, timeouts=None,
+                 health_callback=None, auto_reconnect=False,
+                 retry_policy=DEFAULT_RETRY_POLICY, metrics=None,
+                 snapshot=None):
+        self.host = host or self.HOST
+        self.port = port or self.PORT
+        self.heartbeat_port = heartbeat_port or self.HEARTBEAT_PORT
+        self.timeouts = DEFAULT_TIMEOUTS.copy()
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._scheduler = CommandScheduler()
+        self.retry_policy = retry_policy
+        self.metrics = metrics
+        self.snapshot = snapshot
+        self.retry_counts = Counter()
+        self._retry_lock = threading.Lock()
         self._config = None
-        self._file_list = None
+        self._file_index = None
+        self._card_info = None  # SD Card info when file list last validated
+        self._saved_snapshot = None
         self._mode = None
-        self._heartbeat_timer = None
+        self.health_callback = health_callback
+        self.auto_reconnect = auto_reconnect
+        self._connection_lock = threading.Lock()
+        self._heartbeat = None
+        self._lost = None  # Mode and time when connection lost
+        self._reconnect_thread = None
         if mode is not None:
             self.connect(mode)
 
     def __del__(self):
         self.disconnect()
+        self._session.close()
 
     def __enter__(self):
         return self
@@ -102,74 +620,175 @@ class YIDashcam():
     def __exit__(self, exc_type, exc_value, traceback):
         self.disconnect()
 
-    def _send_cmd(self, cmd, path="/", stream=False, par=None, **kwargs):
-        """Send a command to the dashcam"""
+    def _request(self, cmd, path="/", stream=False, par=None, headers=None,
+                 **kwargs):
+        """Send a command to the dashcam, returning the HTTP response"""
         if not self.connected and cmd not in (Command.connect, Command.mode):
             raise YIDashcamException("Dashcam not connected")
 
-        params = OrderedDict()  # Order of parameters is important
-        if cmd >= 0:
-            params['custom'] = 1  # Must be first!
-            params['cmd'] = int(cmd)
-        if par is not None:
-            params['par'] = int(par)
-        params.update(kwargs)
-        url = "http://{}/{}".format(self.HOST, path.lstrip("/"))
+        params = _command_params(cmd, par, **kwargs)
+        url = "{}/{}".format(self.base_url, path.lstrip("/"))
+        timeout = self.timeouts[_COMMAND_TIMEOUT_CLASS.get(cmd, 'command')]
+        policy = self.retry_policy
+        start = time.monotonic()
+        for attempt in itertools.count(1):
+            try:
+                # If streamed, only held until headers received
+                with self._scheduler:
+                    sent = time.perf_counter()
+                    res = self._session.get(
+                        url, params=params, headers=headers, stream=stream,
+                        timeout=timeout)
+                if self.metrics is not None:
+                    self.metrics.observe_command(
+                        cmd, time.perf_counter() - sent)
+                _LOG.debug("Sent dashcam command URL: %s", res.url)
+                res.raise_for_status()
+                return res
+            except requests.exceptions.HTTPError as err:
+                failure = err
+                res.close()
+                error = "Bad response to command {} ({})".format(
+                    cmd.name, res.status_code)
+                retry = res.status_code >= 500 \
+                    and cmd not in _NON_IDEMPOTENT_COMMANDS
+            except requests.exceptions.RequestException as err:
+                failure = err
+                error = "Failed to send command {} ({})".format(
+                    cmd.name, type(err).__name__)
+                retry = cmd not in _NON_IDEMPOTENT_COMMANDS or _not_sent(err)
+            if self.metrics is not None:
+                self.metrics.record_error(cmd, failure)
+            delay = policy.delay(attempt - 1)
+            if not retry or attempt >= policy.attempts \
+                    or time.monotonic() + delay - start > policy.budget:
+                if attempt > 1:
+                    error = "{} after {} attempts".format(error, attempt)
+                raise YIDashcamException(error) from failure
+            with self._retry_lock:
+                self.retry_counts[cmd] += 1
+            if self.metrics is not None:
+                self.metrics.record_retry(cmd)
+            _LOG.debug("%s, retrying in %.2fs", error, delay)
+            time.sleep(delay)
+
+    def _send_cmd(self, cmd, path="/", stream=False, par=None,
+                  chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+        """Send a command to the dashcam"""
+        if stream:
+            res = self._request(cmd, path, stream=True, par=par, **kwargs)
+            return res.iter_content(chunk_size)  # Return iterator for data
+        if cmd in _SINGLE_FLIGHT_COMMANDS:
+            key = (cmd, path, par, tuple(sorted(kwargs.items())))
+            return self._scheduler.single_flight(
+                key, lambda: self.__send_cmd(cmd, path, par, kwargs))
+        return self.__send_cmd(cmd, path, par, kwargs)
+
+    def __send_cmd(self, cmd, path, par, kwargs):
+        res = self._request(cmd, path, par=par, **kwargs)
         try:
-            res = requests.get(url, params=params, stream=stream, timeout=5)
-            _LOG.debug("Sent dashcam command URL: %s", res.url)
-            res.raise_for_status()
-        except requests.exceptions.HTTPError:
-            raise YIDashcamException("Bad response to command")
-        except requests.exceptions.RequestException:
-            raise YIDashcamException("Failed to send command")
+            return _parse_cmd_response(
+                cmd, path, res.headers.get('content-type'), res.text)
+        except YIDashcamException as err:
+            self._command_failed(cmd, err)
+            raise
 
-        if stream:
-            return res.iter_content(1024)  # Return iterator for data
-
-        if res.headers.get('content-type') == "text/xml":
-            res_xml = ET.fromstring(res.text)
-            res_cmd = res_xml.find("Cmd")
-            res_status = res_xml.find("Status")
-            if res_cmd is not None and int(res_cmd.text) == cmd and \
-                    res_status is not None:
-                status = int(res_status.text)
-                if status == -256:
-                    self._heartbeat_timer.cancel()
-                    self._heartbeat_timer = None
-                    self._mode = None
-                    raise YIDashcamConnectionException("Lost connection")
-                elif status < 0:
-                    raise YIDashcamException("Bad status returned: {}".format(
-                        status))
-                res_str = res_xml.find("String")
-                if res_str is not None:
-                    return res_str.text
-                res_value = res_xml.find("Value")
-                if res_value is not None:
-                    return res_value.text
-                return res_status.text
-        elif res.headers.get('content-type') == "text/html":
-            res_html = ET.fromstring(res.text)
-            res_title = res_html.find("head/title")
-            if res_title is not None \
-                    and res_title.text.lower() == "page not found":
-                # Doesn't raise expected 404 in HTTP code
-                raise YIDashcamFileException("File not found {}".format(path))
-        return res.text
-
-    def __send_heartbeat(self):
-        """Send periodic heartbeat to dashcam"""
+    def _check_response(self, cmd, res_xml):
+        """Parse XML response to command, updating state if connection lost
+
+        Returns `None` if not a response to `cmd`"""
         try:
-            self._heartbeat_sock.sendall(b"02:001:0")
-        except OSError:
-            _LOG.debug("Heartbeat failed", exc_info=True)
-            self._heartbeat_timer = None
+            return _parse_response(cmd, res_xml)
+        except YIDashcamException as err:
+            self._command_failed(cmd, err)
+            raise
+
+    def _command_failed(self, cmd, err):
+        """Update state and metrics after dashcam reports `cmd` failed"""
+        if self.metrics is not None:
+            self.metrics.record_error(cmd, err)
+        if isinstance(err, YIDashcamConnectionException):
+            self._lost_connection()
+
+    def _lost_connection(self):
+        """Update state after connection with dashcam lost"""
+        with self._connection_lock:
+            heartbeat, self._heartbeat = self._heartbeat, None
+            if heartbeat is None:
+                return  # Already lost
+            self._lost = (self._mode, time.monotonic())
             self._mode = None
+        heartbeat.stop()
+        _LOG.debug("Lost connection to dashcam")
+        self._health_changed(Health.lost)
+        if self.auto_reconnect and (self._reconnect_thread is None
+                                    or not self._reconnect_thread.is_alive()):
+            self._reconnect_thread = threading.Thread(
+                target=YIDashcam._reconnect, args=(weakref.proxy(self), ),
+                name="YIDashcamReconnect", daemon=True)
+            self._reconnect_thread.start()
+
+    def _reconnect(self):
+        """Reconnect to dashcam, until connected or no longer wanted"""
+        try:
+            while self.auto_reconnect and self._lost is not None:
+                try:
+                    self.connect(self._lost[0] or Mode.video)
+                except YIDashcamException:
+                    _LOG.debug("Failed to reconnect", exc_info=True)
+                    time.sleep(RECONNECT_INTERVAL)
+                else:
+                    _LOG.debug("Reconnected to dashcam")
+        except ReferenceError:
+            pass  # Instance no longer in use
+
+    def _heartbeat_health(self, health):
+        """Handle change in `Health` reported by heartbeat"""
+        if health == Health.lost:
+            self._lost_connection()
         else:
-            self._heartbeat_timer = threading.Timer(
-                10, YIDashcam.__send_heartbeat, args=(self, ))
-            self._heartbeat_timer.start()
+            self._health_changed(health)
+
+    def _health_changed(self, health):
+        if self.health_callback is not None:
+            self.health_callback(health)
+
+    @property
+    def health(self):
+        """`Health` of connection with dashcam"""
+        heartbeat = self._heartbeat
+        if heartbeat is not None:
+            return heartbeat.health
+        elif self._lost is not None:
+            return Health.lost
+        return Health.disconnected
+
+    @property
+    def heartbeat_latency(self):
+        """Last heartbeat round-trip time, in seconds
+
+        `None` if not connected, or dashcam hasn't replied to heartbeats"""
+        heartbeat = self._heartbeat
+        return heartbeat.latency if heartbeat is not None else None
+
+    @property
+    def missed_heartbeats(self):
+        """Number of heartbeats in a row without a reply"""
+        heartbeat = self._heartbeat
+        return heartbeat.missed if heartbeat is not None else 0
+
+    def priority(self, priority):
+        """Context manager to send commands from this thread at `priority`
+
+        e.g. `with yi.priority(Priority.background): ...`"""
+        return self._scheduler.priority(priority)
+
+    @property
+    def base_url(self):
+        """Base URL for HTTP requests to dashcam"""
+        if self.port == 80:
+            return "http://{}".format(self.host)
+        return "http://{}:{}".format(self.host, self.port)
 
     @property
     def connected(self):
@@ -189,107 +808,153 @@ class YIDashcam():
         except YIDashcamException as err:
             raise YIDashcamException("Error entering mode {}".format(err))
         self._mode = mode
-        if self._mode == Mode.file:
-            self._file_list = None  # Cache now potentially wrong
+        if self._mode == Mode.file and not self._card_unchanged():
+            self._clear_file_list()  # Cache now potentially wrong
 
     def connect(self, mode=Mode.video):
-        """Connect to dashcam"""
+        """Connect to dashcam
+
+        If reconnecting within `RECONNECT_KEEP_CACHE` seconds of the
+        connection being lost, the cached config and file list are kept."""
         if self.connected:
             raise YIDashcamException("Already connected")
         mode = Mode(mode)
 
-        try:
-            self._send_cmd(Command.connect)
-        except YIDashcamException:
-            raise YIDashcamConnectionException("Failed to connect")
-
-        self._heartbeat_sock = socket.socket(socket.AF_INET,
-                                             socket.SOCK_STREAM)
-        self._heartbeat_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY,
-                                        1)
-        self._heartbeat_sock.settimeout(10)
-        self._heartbeat_sock.connect((self.HOST, 3333))
-        YIDashcam.__send_heartbeat(weakref.proxy(self))
-
-        self._config = None
-        self._file_list = None
-        self.set_mode(mode)
+        with self._scheduler:
+            try:
+                self._send_cmd(Command.connect)
+                heartbeat = Heartbeat(
+                    self.host, self.heartbeat_port, HEARTBEAT_INTERVAL,
+                    callback=_weak_callback(self._heartbeat_health))
+            except (OSError, YIDashcamException):
+                raise YIDashcamConnectionException("Failed to connect")
+
+            if self._lost is None \
+                    or time.monotonic() - self._lost[1] > RECONNECT_KEEP_CACHE:
+                self._config = None
+                self._clear_file_list()
+            file_index, card_info = self._file_index, self._card_info
+            with self._connection_lock:
+                self._heartbeat = heartbeat
+                self._lost = None
+            try:
+                self.set_mode(mode)
+            except YIDashcamException:
+                self._lost_connection()
+                raise
+            # Not changed since connection lost
+            self._file_index, self._card_info = file_index, card_info
+            if self.snapshot is not None and self._file_index is None:
+                self._load_snapshot()
         _LOG.debug("Connected to dashcam")
+        self._health_changed(Health.healthy)
 
     def disconnect(self):
         """Disconnect from dashcam"""
+        with self._connection_lock:
+            heartbeat, self._heartbeat = self._heartbeat, None
+            self._lost = None  # Stops any attempts to reconnect
+        if heartbeat is not None:
+            heartbeat.stop()
+        if self.snapshot is not None:
+            self._save_snapshot()
         if self.connected:
-            self._heartbeat_timer.cancel()
             try:
-                self._heartbeat_sock.shutdown(socket.SHUT_RDWR)
-                self._heartbeat_sock.close()
                 # Doesn't matter if we fail here, as dash cam will disconnect
                 # itself without a heartbeat.
                 self._send_cmd(Command.disconnect)
-            except (OSError, YIDashcamException):
+            except YIDashcamException:
                 _LOG.debug("Error disconnecting", exc_info=True)
             finally:
                 self._mode = None
+            self._health_changed(Health.disconnected)
 
     @property
     def card_info(self):
         """Information of SD Card in dashcam"""
-        info_et = ET.fromstring(self._send_cmd(Command.card_info))
-        return {
-            'type': info_et.find('CARDTYPE').text,
-            'write_rate': int(info_et.find('CARDWRITERATE').text),
-            'capacity': int(info_et.find('CARDCAPACITY').text),
-            'vendor': int(info_et.find('CARDVENDOR').text),
-            'slow_card': bool(int(info_et.find('CTNSLOWCARD').text)),
-            'average_use_duration': int(info_et.find('AVGUSEDUR').text),
-            'total_use': int(info_et.find('CTNTOTALUSE').text),
-            # 'LDW': int(info_et.find('CTNLDW').string),
-            # 'FCW': int(info_et.find('CTNFCW').string),
-        }
+        return _parse_card_info(self._send_cmd(Command.card_info))
 
     @property
     def config(self):
         """Config from dashcam"""
+        if self.metrics is not None:
+            self.metrics.record_cache('config', self._config is not None)
         if self._config is None:
-            self._config = {}
-            config_et = ET.fromstring(self._send_cmd(Command.config))
-            for cmd_et, status_et in zip(
-                    config_et.iter('Cmd'), config_et.iter('Status')):
-                try:
-                    option = config.Option(int(cmd_et.text))
-                except ValueError:
-                    _LOG.debug("Config option %s not recognised", cmd_et.text)
-                else:
-                    try:
-                        value = int(status_et.text)
-                    except ValueError:
-                        value = status_et.text
-                    self._config[option] = config.option_map[option](value)
+            self._config = _parse_config(self._send_cmd(Command.config))
         return self._config.copy()
 
     def set_config(self, option, value):
         """Set a configuration option on the dashcam
 
         Many options can't changed without being in "video" mode with recording
-        stopped, so method will do this first"""
-        try:
-            value = config.option_map[option](value)
-        except KeyError:
-            raise ValueError("Not a valid config option: {}".format(option))
-        except ValueError:
-            raise ValueError("Invalid value for config option: {}: {}".format(
-                option, value))
-
-        if self.mode != Mode.video:
-            # Must be in "video" mode to change (most) config options
-            self.set_mode(Mode.video)
-            time.sleep(2)  # Camera has to settle into mode...
-        while self.recording:
-            self.stop_record()
-            time.sleep(0.1)
-
-        self._send_cmd(option, par=value)
-        self._config = None  # Cache now incorrect
+        stopped, so method will do this first (see `apply_config`)"""
+        self.apply_config({option: value})
+
+    def apply_config(self, values, timeout=READY_TIMEOUT):
+        """Set several configuration options on the dashcam at once
+
+        `values` maps options to values, all of which are validated before
+        any are sent. Options already set to the value are skipped. The
+        dashcam is put into "video" mode and recording stopped just once, and
+        afterwards returned to the mode it was in (recording again if it
+        was). Rather than waiting fixed times for the dashcam to settle, it is
+        polled until it accepts commands, for up to `timeout` seconds.
+
+        The cached config is updated in place, rather than fetched again."""
+        values = {option: _config_value(option, value)
+                  for option, value in values.items()}
+
+        with self._scheduler:
+            if self._config is not None:
+                values = {option: value for option, value in values.items()
+                          if self._config.get(option) != value}
+            if not values:
+                return
+            deadline = time.monotonic() + timeout
+            previous_mode = self.mode
+            if previous_mode != Mode.video:
+                # Must be in "video" mode to change (most) config options
+                self.set_mode(Mode.video)
+            was_recording = self._until_ready(
+                lambda: self.recording, deadline)
+            if was_recording:
+                self._until_ready(self.stop_record, deadline)
+
+            for option, value in values.items():
+                self._until_ready(
+                    lambda: self._send_cmd(option, par=value), deadline)
+                if self._config is not None:
+                    self._config[option] = value
+
+            if previous_mode != Mode.video:
+                self.set_mode(previous_mode)
+            elif was_recording:
+                self._until_ready(self.start_record, deadline,
+                                  stop_recording=False)
+
+    def _until_ready(self, func, deadline, stop_recording=True):
+        """Call `func` until accepted by the dashcam, or `deadline` passes
+
+        If `stop_recording`, recording is stopped between attempts, as the
+        dashcam may start recording by itself when entering "video" mode."""
+        while True:
+            try:
+                return func()
+            except YIDashcamConnectionException:
+                raise
+            except YIDashcamException:
+                if time.monotonic() >= deadline:
+                    raise
+            time.sleep(READY_POLL_INTERVAL)
+            if not stop_recording:
+                continue
+            try:
+                if self.recording:
+                    self.stop_record()
+            except YIDashcamConnectionException:
+                raise
+            except YIDashcamException:
+                pass  # Not ready yet
 
     @property
     def firmware_version(self):
@@ -313,90 +978,563 @@ class YIDashcam():
         self._send_cmd(
             Command.clock, str=date_time.strftime("%Y-%m-%d_%H:%M:%S"))
 
+    def _clear_file_list(self):
+        """Clear cached file list, when it is potentially wrong"""
+        self._file_index = None
+        self._card_info = None
+
+    def _card_unchanged(self):
+        """Is SD Card unchanged since file list was cached, if using snapshot
+        """
+        if self.snapshot is None or self._card_info is None:
+            return False
+        try:
+            return self.card_info == self._card_info
+        except YIDashcamException:
+            return False
+
+    def _load_snapshot(self):
+        """Load file list from snapshot, if card unchanged"""
+        serial_number = self.serial_number  # Fetched, so can be trusted
+        card_info = self.card_info
+        files = self.snapshot.load(serial_number, card_info)
+        if files is None:
+            return
+        _LOG.debug("Loaded file list from snapshot")
+        self._file_index = FileIndex(files)
+        self._card_info = card_info
+        self._saved_snapshot = (
+            serial_number, self._file_index.tag, card_info)
+
+    def _save_snapshot(self):
+        """Save file list to snapshot, if cached along with config"""
+        config_values = self._config
+        file_index = self._file_index
+        card_info = self._card_info
+        if config_values is None or file_index is None or card_info is None:
+            return
+        serial_number = config_values[config.Option.serial_number]
+        saved = (serial_number, file_index.tag, card_info)
+        if saved == self._saved_snapshot:
+            return  # Unchanged since last saved
+        try:
+            self.snapshot.save(serial_number, card_info, file_index.files())
+        except OSError:
+            _LOG.warning("Failed to save snapshot", exc_info=True)
+        else:
+            self._saved_snapshot = saved
+
+    def iter_files(self):
+        """Iterate over files on dashcam SD Card
+
+        If the file list isn't cached, files are yielded as the listing is
+        streamed from the dashcam, and cached once the listing is complete.
+        Otherwise files are yielded from the cache, oldest first. The
+        command slot is only held until the listing starts to arrive, so
+        iterating doesn't hold up other commands."""
+        file_index = self._file_index
+        if file_index is not None:
+            if self.metrics is not None:
+                self.metrics.record_cache('file_list', True)
+            yield from file_index.files()
+            return
+        if self.metrics is not None:
+            self.metrics.record_cache('file_list', False)
+        card_info = self._listing_card_info()
+        files = []
+        for file in self._stream_file_list():
+            files.append(file)
+            yield file
+        self._cache_file_list(files, card_info)
+
+    def _stream_file_list(self):
+        """Stream file list from dashcam"""
+        if self.mode != Mode.file:
+            self.set_mode(Mode.file)
+        _LOG.debug("Fetching file list from dash cam")
+        with self._request(Command.file_list, stream=True) as res:
+            try:
+                yield from _iter_file_list_xml(
+                    res.iter_content(FILE_LIST_CHUNK_SIZE))
+            except YIDashcamException as err:
+                # Raised by parser on bad status
+                self._command_failed(Command.file_list, err)
+                raise
+            except (ET.ParseError, KeyError, ValueError) as err:
+                if self.metrics is not None:
+                    self.metrics.record_error(Command.file_list, err)
+                raise YIDashcamException("Bad file list from dashcam")
+
+    def _listing_card_info(self):
+        """SD Card info to record with file list, if using snapshot"""
+        if self.snapshot is None:
+            return None
+        self.config  # Needed for snapshot
+        return self.card_info
+
+    def _cache_file_list(self, files, card_info):
+        """Cache `files` as `FileIndex`, unless cached while fetching
+
+        Returns the cached `FileIndex`."""
+        with self._scheduler:
+            file_index = self._file_index
+            if file_index is not None:
+                return file_index  # Already fresh, and maybe since changed
+            file_index = self._file_index = FileIndex(files)
+            if card_info is not None:
+                self._card_info = card_info
+                self._save_snapshot()
+            return file_index
+
+    def _fetch_file_list(self):
+        """Fetch file list from dashcam and cache it, unless already cached
+
+        Returns the `FileIndex`."""
+        file_index = self._file_index
+        if file_index is not None:
+            if self.metrics is not None:
+                self.metrics.record_cache('file_list', True)
+            return file_index
+        if self.metrics is not None:
+            self.metrics.record_cache('file_list', False)
+        card_info = self._listing_card_info()
+        return self._cache_file_list(
+            list(self._stream_file_list()), card_info)
+
+    def refresh_file_list(self):
+        """Fetch file list from dashcam again, updating cached list in place
+
+        Returns tuple of lists of files added (or changed) and removed. The
+        cached `FileIndex` is kept, with its `version` advancing for each
+        change, so `FileIndex.changes_since` carries on working. Files
+        changed here (e.g. deleted) while the list was being fetched are
+        left as they are. If the file list wasn't cached, it is fetched."""
+        if self.mode != Mode.file:
+            self.set_mode(Mode.file)
+        file_index = self._file_index
+        if file_index is None:
+            return self.file_index.files(), []
+        tag = file_index.tag
+        card_info = self.card_info if self.snapshot is not None else None
+        files = list(self._stream_file_list())
+        with self._scheduler:
+            if self._file_index is not file_index:
+                return [], []  # Replaced while fetching, so already fresh
+            added, removed = file_index.changes_since(tag) or ([], [])
+            changed = {file.path for file in added}.union(removed)
+            listed = {file.path: file for file in files}
+            removed = [file for file in file_index
+                       if file.path not in listed
+                       and file.path not in changed]
+            added = [file for file in files
+                     if file.path not in changed
+                     and file_index.get(file.path) != file]
+            for file in removed:
+                file_index.remove(file.path)
+            for file in added:
+                file_index.add(file)
+            if card_info is not None:
+                self._card_info = card_info
+        return added, removed
+
+    @property
+    def file_index(self):
+        """Time ordered `FileIndex` of files on dashcam SD Card
+
+        The index is cached, and kept up to date as files are deleted or
+        photos taken, so should not be modified directly. If not cached,
+        concurrent callers share one fetch of the listing."""
+        file_index = self._file_index
+        if file_index is None:
+            return self._scheduler.single_flight(
+                Command.file_list, self._fetch_file_list)
+        if self.metrics is not None:
+            self.metrics.record_cache('file_list', True)
+        return file_index
+
     @property
     def file_list(self):
         """List of files on dashcam SD Card"""
-        if not self._file_list:
-            if self.mode != Mode.file:
-                self.set_mode(Mode.file)
-            _LOG.debug("Fetching file list from dash cam")
-            files_et = ET.fromstring(self._send_cmd(Command.file_list))
-            self._file_list = [
-                YIDashcamFile(
-                    file.find("NAME").text, file.find("FPATH").text,
-                    int(file.find("SIZE").text), datetime.datetime.strptime(
-                        file.find("TIME").text, "%Y/%m/%d %H:%M:%S"),
-                    bool(int(file.find("ATTR").text) & 1))
-                for file in files_et.iter("File")
-            ]
-        return self._file_list.copy()
+        return self.file_index.files()
 
     @property
     def roadmap_list(self):
         """List of files from "roadmap" folder on dashcam SD Card"""
-        return [file for file in self.file_list
-                if "movie" in file.path.lower()]
+        return self.file_index.files('roadmap')
 
     @property
     def emergency_list(self):
         """List of files from "emergency" folder on dashcam SD Card"""
-        return [file for file in self.file_list if "emr" in file.path.lower()]
+        return self.file_index.files('emergency')
 
     @property
     def photo_list(self):
         """List of files from photo folder on dashcam SD Card"""
-        return [file for file in self.file_list
-                if "photo" in file.path.lower()]
+        return self.file_index.files('photo')
+
+    def files_between(self, start, end, category=None):
+        """List of files on dashcam SD Card from `start` until `end` time
+
+        Optionally limited to files in `category`. Files are oldest first."""
+        return self.file_index.files_between(start, end, category)
+
+    def latest(self, n=1, category=None):
+        """List of `n` most recent files on dashcam SD Card, newest first
 
-    def get_thumbnail(self, path):
+        Optionally limited to files in `category`."""
+        return self.file_index.latest(n, category)
+
+    def get_thumbnail(self, path, chunk_size=STREAM_CHUNK_SIZE):
         """Get a thumbnail for specified file on dashcam SD Card
 
-        Returns iterator for data"""
+        Returns iterator for data, in chunks of up to `chunk_size` bytes. The
+        thumbnail is received in full before the first chunk is yielded, so
+        iterating doesn't hold up other commands."""
         try:
             path = path.url_path
         except AttributeError:
             path = YIDashcamFile._url_path(path)
-        yield from self._send_cmd(Command.file_thumbnail, path, stream=True)
+        with self._scheduler:  # Held until thumbnail received
+            chunks = list(self._measure_transfer(
+                'thumbnail', self._send_cmd(
+                    Command.file_thumbnail, path, stream=True,
+                    chunk_size=chunk_size)))
+        yield from chunks
+
+    def get_thumbnail_bytes(self, path):
+        """Get a thumbnail for specified file on dashcam SD Card as bytes"""
+        return b"".join(self.get_thumbnail(path))
+
+    def _measure_transfer(self, kind, data):
+        """Wrap iterator of `data`, recording bytes and time to metrics"""
+        if self.metrics is None:
+            return data
+        return self._measured_transfer(kind, data)
+
+    def _measured_transfer(self, kind, data):
+        size = 0
+        start = time.perf_counter()
+        try:
+            for chunk in data:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.metrics.record_transfer(
+                kind, size, time.perf_counter() - start)
 
-    def get_file(self, path):
+    def get_file(self, path, start=0, end=None, chunk_size=STREAM_CHUNK_SIZE):
         """Get the specified file from the dashcam SD Card
 
-        Returns iterator for data"""
+        Part of the file can be fetched, from byte `start` up to and including
+        `end`, using a HTTP Range request. If the dashcam ignores the range,
+        data outside of it is discarded.
+
+        Returns iterator for data, in chunks of up to `chunk_size` bytes"""
         try:
             path = path.url_path
         except AttributeError:
             path = YIDashcamFile._url_path(path)
-        yield from self._send_cmd(Command.file_get, path, stream=True)
-
-    def delete_file(self, path, force=False):
-        """Delete specified file from the dashcam SD Card"""
+        if not start and end is None:
+            yield from self._measure_transfer('file', self._send_cmd(
+                Command.file_get, path, stream=True, chunk_size=chunk_size))
+            return
+        headers = {'Range': "bytes={}-{}".format(
+            start, "" if end is None else end)}
+        with self._request(Command.file_get, path, stream=True,
+                           headers=headers) as res:
+            data = res.iter_content(chunk_size)
+            if res.status_code != 206:
+                _LOG.debug("Range ignored by dashcam for %s", path)
+                data = _byte_range(data, start, end)
+            yield from self._measure_transfer('file', data)
+
+    def save_file(self, path, dest, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        """Save the specified file from the dashcam SD Card to `dest`
+
+        `dest` can be a writable binary file object, or local path to write
+        to. Data is read directly into a reused `chunk_size` buffer, rather
+        than via `get_file`, which is much faster on slow CPUs.
+
+        Returns number of bytes written"""
         try:
-            path = path.path
+            path = path.url_path
         except AttributeError:
-            pass
-        try:
-            if force:
-                # Force delete for emergency files
-                self._send_cmd(Command.file_force_delete, str=path)
+            path = YIDashcamFile._url_path(path)
+        start = time.perf_counter()
+        with self._request(Command.file_get, path, stream=True) as res:
+            if hasattr(dest, 'write'):
+                size = _write_response(res, dest, chunk_size)
             else:
-                self._send_cmd(Command.file_delete, str=path)
+                with open(dest, 'wb') as local_file:
+                    size = _write_response(res, local_file, chunk_size)
+        if self.metrics is not None:
+            self.metrics.record_transfer(
+                'file', size, time.perf_counter() - start)
+        return size
+
+    def download_file(self, file, path, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                      retries=3, progress=None, limiter=None):
+        """Download `file` from the dashcam SD Card to local `path`
+
+        Data is written to "`path`.part", alongside a small "`path`.part.json"
+        journal identifying the file on the dashcam. If the connection drops,
+        the download is resumed from the last byte written using a HTTP Range
+        request, up to `retries` times. A later call for the same file will
+        also resume from an existing partial file. If the dashcam ignores the
+        Range request, the download restarts from the beginning.
+
+        If `progress` is given, it is called with the number of bytes held
+        locally after each chunk is written (including any resumed from).
+        If `limiter` (a `BandwidthLimiter`) is given, transfer is slowed to
+        keep within its limits.
+
+        Returns `path` once the download is complete and the size verified."""
+        part_path = "{}.part".format(path)
+        journal_path = "{}.json".format(part_path)
+        journal = {'path': file.path, 'size': file.size,
+                   'time': file.time.isoformat()}
+        try:
+            with open(journal_path) as journal_file:
+                resumable = json.load(journal_file) == journal
+        except (OSError, ValueError):
+            resumable = False
+        if not resumable:
+            with open(journal_path, 'w') as journal_file:
+                json.dump(journal, journal_file)
+
+        with open(part_path, 'ab' if resumable else 'wb') as local_file:
+            attempt = 0
+            while local_file.tell() < file.size:
+                offset = local_file.tell()
+                headers = {'Range': "bytes={}-".format(offset)} \
+                    if offset else None
+                try:
+                    res = self._request(Command.file_get, file.url_path,
+                                        stream=True, headers=headers)
+                    with res:
+                        if offset and res.status_code != 206:
+                            _LOG.debug("Range ignored by dashcam for %s",
+                                       file.path)
+                            local_file.seek(0)
+                            local_file.truncate()
+                        if progress is not None:
+                            progress(local_file.tell())
+
+                        def callback(size):
+                            if limiter is not None:
+                                limiter.consume(size)
+                            if progress is not None:
+                                progress(local_file.tell())
+                        written = local_file.tell()
+                        started = time.perf_counter()
+                        try:
+                            _write_response(
+                                res, local_file, chunk_size, callback)
+                        finally:
+                            if self.metrics is not None:
+                                self.metrics.record_transfer(
+                                    'file', local_file.tell() - written,
+                                    time.perf_counter() - started)
+                    if local_file.tell() < file.size:
+                        raise YIDashcamException("Transfer ended early")
+                except (requests.exceptions.RequestException,
+                        YIDashcamException) as err:
+                    if isinstance(err, YIDashcamFileException) \
+                            or attempt >= retries:
+                        raise
+                    attempt += 1
+                    _LOG.debug("Resuming download of %s from byte %i",
+                               file.path, local_file.tell(), exc_info=True)
+                    local_file.flush()
+                    # Give link a chance to recover
+                    time.sleep(self.retry_policy.delay(attempt - 1))
+
+        size = os.path.getsize(part_path)
+        if size != file.size:
+            os.remove(part_path)
+            os.remove(journal_path)
+            raise YIDashcamFileException(
+                "Downloaded size of {} is {} bytes, expected {}".format(
+                    file.path, size, file.size))
+        os.replace(part_path, path)
+        os.remove(journal_path)
+        return path
+
+    def download_files(self, files, dest_dir, max_workers=2, progress=None,
+                       chunk_size=DOWNLOAD_CHUNK_SIZE, retries=3,
+                       limiter=None):
+        """Download `files` from the dashcam SD Card into `dest_dir`
+
+        Up to `max_workers` files are transferred concurrently; the dashcam
+        copes poorly with more than a few connections. Each file is fetched
+        with `download_file`, so interrupted transfers are resumed. If
+        `progress` is given, it is called with a `DownloadProgress` after each
+        chunk is written. Note this is called from the worker threads.
+        `limiter` is shared by all transfers (see `download_file`).
+
+        Transfers are requested at `Priority.background`, so as not to hold up
+        other commands.
+
+        Each file is saved by name directly in `dest_dir`, so files with the
+        same name from different folders on the SD Card must be downloaded
+        into separate directories, as `yidashcam.sync.sync` does; otherwise
+        `ValueError` is raised before any are downloaded.
+
+        Returns dict of files to their local path. If any file fails to
+        download, `YIDashcamDownloadException` is raised once all other
+        downloads have finished."""
+        files = list(files)
+        names = Counter(file.name for file in files)
+        duplicates = sorted(name for name, count in names.items() if count > 1)
+        if duplicates:
+            raise ValueError("Files with same name: {}".format(
+                ", ".join(duplicates)))
+        os.makedirs(dest_dir, exist_ok=True)
+        if self.mode != Mode.file:
+            self.set_mode(Mode.file)
+
+        total_size = sum(file.size for file in files)
+        totals = {'bytes': 0, 'start': time.monotonic()}
+        lock = threading.Lock()
+
+        def download(file):
+            file_state = {'bytes': 0, 'resumed': None,
+                          'start': time.monotonic()}
+
+            def file_progress(file_bytes):
+                with lock:
+                    totals['bytes'] += file_bytes - file_state['bytes']
+                    total_bytes = totals['bytes']
+                if file_state['resumed'] is None \
+                        or file_bytes < file_state['resumed']:
+                    # Don't count data resumed from towards rate
+                    file_state['resumed'] = file_bytes
+                file_state['bytes'] = file_bytes
+                if progress is not None:
+                    now = time.monotonic()
+                    progress(DownloadProgress(
+                        file, file_bytes,
+                        (file_bytes - file_state['resumed'])
+                        / max(now - file_state['start'], 1e-6),
+                        total_bytes, total_size,
+                        total_bytes / max(now - totals['start'], 1e-6)))
+
+            with self.priority(Priority.background):
+                return self.download_file(
+                    file, os.path.join(dest_dir, file.name),
+                    chunk_size=chunk_size, retries=retries,
+                    progress=file_progress, limiter=limiter)
+
+        downloaded = {}
+        failed = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = {executor.submit(download, file): file for file in files}
+            for future in concurrent.futures.as_completed(futures):
+                file = futures[future]
+                try:
+                    downloaded[file] = future.result()
+                except (OSError, YIDashcamException) as err:
+                    _LOG.debug("Failed to download %s", file.path,
+                               exc_info=True)
+                    failed[file] = err
+        if failed:
+            raise YIDashcamDownloadException(
+                "Failed to download {} of {} files".format(
+                    len(failed), len(files)),
+                downloaded, failed)
+        return downloaded
+
+    def delete_file(self, path, force=False):
+        """Delete specified file from the dashcam SD Card
 
-            if "movie" in path.lower():
-                path = re.sub(r"^(.+movie)(.+)(\..{3})$","\\1_s\\2_s\\3", path,
-                              flags=re.IGNORECASE)
+        Its "_s" companion, if any, is also deleted (see `delete_files`)"""
+        try:
+            self.delete_files([path], force)
+        except YIDashcamDeleteException as err:
+            raise next(iter(err.failed.values()))
+
+    def delete_files(self, files, force=False):
+        """Delete `files` (or paths) from the dashcam SD Card
+
+        The low resolution "_s" companion of each roadmap clip is deleted
+        straight after it, if in the file list (and the main clip was
+        deleted). If `force`, files are force deleted, as needed for read
+        only (i.e. emergency) files. The deletes are sent back-to-back, and
+        the cached file list is updated as each succeeds.
+
+        Returns list of paths deleted. If any fail, once the rest have been
+        tried, `YIDashcamDeleteException` is raised."""
+        deletes = _delete_order(files, self.file_index)
+        deleted = []
+        failed = OrderedDict()
+        with self._scheduler:
+            for index, (path, main) in enumerate(deletes):
+                if main in failed:
+                    continue  # Keep companion of clip which wasn't deleted
                 try:
-                    self._send_cmd(Command.file_delete, str=path)
-                except:
-                    pass
-        finally:
-            self._file_list = None  # Cache now wrong
+                    self._send_cmd(
+                        Command.file_force_delete if force
+                        else Command.file_delete, str=path)
+                except YIDashcamConnectionException as err:
+                    # No point trying the rest
+                    failed.update(
+                        (remaining[0], err) for remaining in deletes[index:])
+                    break
+                except YIDashcamException as err:
+                    _LOG.debug("Failed to delete %s", path, exc_info=True)
+                    failed[path] = err
+                else:
+                    deleted.append(path)
+                    if self._file_index is not None:
+                        self._file_index.remove(path)
+        if failed:
+            raise YIDashcamDeleteException(
+                "Failed to delete {} of {} files".format(
+                    len(failed), len(deletes)),
+                deleted, failed)
+        return deleted
 
     def take_photo(self):
         """Capture photo with camera"""
-        if self.mode != Mode.photo:
-            self.set_mode(Mode.photo)
-        self._send_cmd(Command.take_photo)
-        self._file_list = None  # Cache now wrong
+        with self._scheduler:
+            if self.mode != Mode.photo:
+                self.set_mode(Mode.photo)
+            res = self._request(Command.take_photo)
+            try:
+                res_xml = ET.fromstring(res.text)
+            except ET.ParseError:
+                res_xml = ET.Element("Function")
+            self._check_response(Command.take_photo, res_xml)
+            if self._file_index is None:
+                return
+            path = res_xml.findtext("File/FPATH")
+            if path is None:
+                self._clear_file_list()  # Cache now wrong
+                return
+            # Rather than fetch whole file list again, add photo to cache,
+            # using size from a one byte Range request, and time from its
+            # name, or failing that as "now" on this host's clock
+            name = ntpath.basename(path)
+            try:
+                res = self._request(Command.file_get,
+                                    YIDashcamFile._url_path(path),
+                                    headers={'Range': "bytes=0-0"})
+                if res.headers.get('content-type') == "text/html":
+                    # Doesn't raise expected 404 in HTTP code
+                    raise YIDashcamFileException(
+                        "File not found {}".format(path))
+                if res.status_code == 206:
+                    size = int(
+                        res.headers['Content-Range'].rpartition("/")[2])
+                else:  # Range ignored, so whole photo received
+                    size = len(res.content)
+            except (KeyError, ValueError, YIDashcamException):
+                self._clear_file_list()
+            else:
+                time_ = _name_time(name) \
+                    or datetime.datetime.now().replace(microsecond=0)
+                self._file_index.add(
+                    YIDashcamFile(name, path, size, time_, False))
 
     @property
     def recording(self):
@@ -405,9 +1543,10 @@ class YIDashcam():
 
     def start_record(self):
         """Start video recording"""
-        if self.mode != Mode.video:
-            self.set_mode(Mode.video)
-        self._send_cmd(Command.video_record, par=1)
+        with self._scheduler:
+            if self.mode != Mode.video:
+                self.set_mode(Mode.video)
+            self._send_cmd(Command.video_record, par=1)
 
     def stop_record(self):
         """Stop video recording"""
@@ -415,13 +1554,15 @@ class YIDashcam():
 
     def take_video_photo(self):
         """Save photo from active recording"""
-        if not self.recording:
-            raise YIDashcamException(
-                "Can't take video image when not recording")
-        self._send_cmd(Command.video_photo)
+        with self._scheduler:
+            if not self.recording:
+                raise YIDashcamException(
+                    "Can't take video image when not recording")
+            self._send_cmd(Command.video_photo)
 
     def take_emergency_clip(self):
         """Take a "emergency" clip"""
-        if self.mode != Mode.video:
-            self.set_mode(Mode.video)
-        self._send_cmd(Command.video_emergency)
+        with self._scheduler:
+            if self.mode != Mode.video:
+                self.set_mode(Mode.video)
+            self._send_cmd(Command.video_emergency)
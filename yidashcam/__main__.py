@@ -2,12 +2,30 @@
 """Command line tool for interaction with YI Dashcam"""
 
 import argparse
+import atexit
 import enum
 import sys
-import time
 
-from . import __version__, YIDashcam, YIDashcamException
+from . import __version__, CATEGORIES, Mode, YIDashcam, YIDashcamException
+from .bandwidth import BandwidthLimiter
+from .catalog import Catalog, parse_time
 from .config import Option, option_map, PhotoResolution
+from .metrics import Metrics
+from .snapshot import SnapshotStore
+from .sync import sync
+
+
+def format_progress(progress):
+    return "{0:5.1f}% {1:6.2f} MB/s {2}".format(
+        100 * progress.total_bytes / (progress.total_size or 1),
+        progress.total_rate / 1e6, progress.file.name)
+
+
+def format_entry(entry):
+    return "{0} {1} {2:<9} {3:8.1f} MB {4:<10} {5}".format(
+        entry.serial_number, entry.file.time, entry.file.category,
+        entry.file.size / 1e6, "on camera" if entry.on_camera else "",
+        entry.local_path or entry.file.path)
 
 
 def format_config(option, value):
@@ -20,6 +38,26 @@ def format_config(option, value):
 parser = argparse.ArgumentParser(prog=YIDashcam.__module__)
 parser.add_argument(
     '--version', action='version', version='%(prog)s v{}'.format(__version__))
+parser.add_argument(
+    '--stats', action='store_true',
+    help="print summary of dashcam request statistics on exit")
+parser.add_argument(
+    '--host', help="dashcam address (default: {})".format(YIDashcam.HOST))
+parser.add_argument(
+    '--port', type=int,
+    help="dashcam HTTP port (default: {})".format(YIDashcam.PORT))
+parser.add_argument(
+    '--heartbeat-port', type=int,
+    help="dashcam heartbeat port (default: {})".format(
+        YIDashcam.HEARTBEAT_PORT))
+parser.add_argument(
+    '--snapshot', metavar="DIR",
+    help="directory to keep snapshots of dashcam file list in, "
+         "reused on start if SD Card unchanged")
+parser.add_argument(
+    '--catalog', metavar="FILE",
+    help="SQLite catalog to record files seen and copied in, and to browse "
+         "history from")
 subparsers = parser.add_subparsers(
     title="Commands", dest='command', metavar='COMMAND')
 
@@ -58,26 +96,149 @@ parser_snapshot.add_argument(
     metavar="FILE",
     help="output file to save image (default: filename on camera)")
 
+#  Sync
+parser_sync = subparsers.add_parser(
+    'sync', help='copy new and changed files from dashcam to a directory')
+parser_sync.add_argument(
+    'dest_dir', metavar="DEST", help="directory to copy files into")
+parser_sync.add_argument(
+    '-c',
+    dest='categories',
+    action='append',
+    choices=CATEGORIES,
+    help="category of files to copy, may be repeated (default: all)")
+parser_sync.add_argument(
+    '-d',
+    dest='delete',
+    action='store_true',
+    help="delete files from dashcam once copied")
+parser_sync.add_argument(
+    '-j',
+    dest='max_workers',
+    type=int,
+    default=2,
+    help="number of files to download at once (default: 2)")
+parser_sync.add_argument(
+    '-b',
+    dest='bandwidth',
+    type=float,
+    help="limit on bandwidth in MB/s (default: none)")
+
+#  Fleet
+parser_fleet = subparsers.add_parser(
+    'fleet', help='copy files from many dashcams at once')
+parser_fleet.add_argument(
+    'dest_dir', metavar="DEST",
+    help="directory to copy files into, in a sub-directory per dashcam")
+parser_fleet.add_argument(
+    'addresses', metavar="ADDRESS", nargs='+',
+    help="dashcam address, as host[:port[:heartbeat_port]]")
+parser_fleet.add_argument(
+    '-c',
+    dest='categories',
+    action='append',
+    choices=CATEGORIES,
+    help="category of files to copy, may be repeated (default: all)")
+parser_fleet.add_argument(
+    '-d',
+    dest='delete',
+    action='store_true',
+    help="delete files from dashcams once copied")
+parser_fleet.add_argument(
+    '-j',
+    dest='max_workers',
+    type=int,
+    default=2,
+    help="number of files to download at once per dashcam (default: 2)")
+parser_fleet.add_argument(
+    '-b',
+    dest='bandwidth',
+    type=float,
+    help="limit on total bandwidth in MB/s (default: none)")
+parser_fleet.add_argument(
+    '-B',
+    dest='camera_bandwidth',
+    type=float,
+    help="limit on bandwidth per dashcam in MB/s (default: none)")
+
+#  History
+parser_history = subparsers.add_parser(
+    'history', help='list files recorded in catalog (requires --catalog)')
+parser_history.add_argument(
+    '-s',
+    dest='serial_number',
+    help="only files from dashcam with serial number")
+parser_history.add_argument(
+    '-c',
+    dest='category',
+    choices=CATEGORIES,
+    help="only files in category")
+parser_history.add_argument(
+    '--from',
+    dest='start',
+    type=parse_time,
+    metavar="TIME",
+    help="only files from date or time, as YYYY-MM-DD[ HH:MM[:SS]]")
+parser_history.add_argument(
+    '--to',
+    dest='end',
+    type=lambda text: parse_time(text, end=True),
+    metavar="TIME",
+    help="only files until date (inclusive) or time")
+parser_history.add_argument(
+    '-l',
+    dest='local',
+    action='store_true',
+    help="only files which have been copied")
+parser_history.add_argument(
+    '-n',
+    dest='limit',
+    type=int,
+    default=100,
+    help="number of most recent files to list (default: 100)")
+
 # Web Application
-parser_config = subparsers.add_parser(
+parser_webapp = subparsers.add_parser(
     'webapp', help='host local web app to view dashcam videos')
+parser_webapp.add_argument(
+    '-l',
+    dest='local_dirs',
+    metavar="DIR",
+    action='append',
+    default=[],
+    help="directory of previously copied files (e.g. by sync) to serve "
+         "videos from, may be repeated")
 
 if "exposure" in sys.argv:
     #  Allow negative values for exposure
     sys.argv.insert(len(sys.argv) - 1, "--")
 args = parser.parse_args()
 
+snapshot = None
+if args.snapshot is not None:
+    snapshot = SnapshotStore(args.snapshot)
+connection = {'host': args.host, 'port': args.port,
+              'heartbeat_port': args.heartbeat_port, 'snapshot': snapshot}
+catalog = None
+if args.catalog is not None:
+    catalog = Catalog(args.catalog)
+    atexit.register(catalog.close)
+elif args.command == "history":
+    parser.error("history requires --catalog")
+metrics = None
+if args.stats:
+    metrics = Metrics()
+    atexit.register(lambda: print(metrics.summary(), file=sys.stderr))
+
 if args.command is None or args.command == "config":
-    with YIDashcam() as yi:
+    with YIDashcam(metrics=metrics, **connection) as yi:
         if getattr(args, 'option', None) is not None:
             option = Option[args.option]
             val_type = option_map[option]
-            time.sleep(1.5)  #  Need a chance for dashcam to settle...
             if issubclass(val_type, enum.Enum):
                 yi.set_config(option, val_type[args.value])
             elif val_type is bool:
                 yi.set_config(option, args.value.lower() == "true")
-            time.sleep(1)  #  Need a chance for config to set...
             print(format_config(option, yi.config[option]))
         else:
             print(
@@ -86,8 +247,8 @@ if args.command is None or args.command == "config":
                       yi.config.items(), key=lambda x: x[0].name)],
                 sep="\n")
 elif args.command == "stream":
-    with YIDashcam() as yi:
-        print("Connect to video stream at: rtsp://{0.HOST}/xxx.mov".format(yi))
+    with YIDashcam(metrics=metrics, **connection) as yi:
+        print("Connect to video stream at: rtsp://{0.host}/xxx.mov".format(yi))
         print("Press enter to take video photo, or Ctrl-C to exit")
         try:
             while yi.connected:
@@ -101,23 +262,67 @@ elif args.command == "stream":
         except KeyboardInterrupt:
             pass
 elif args.command == "snapshot":
-    with YIDashcam() as yi:
+    with YIDashcam(metrics=metrics, **connection) as yi:
         if args.photo_resolution is not None:
-            time.sleep(1)  #  Need a chance for dashcam to settle...
             yi.set_config(Option.photo_resolution,
                           PhotoResolution[args.photo_resolution])
         yi.take_photo()
-        photo = sorted(yi.photo_list)[-1]
+        photo = yi.latest(1, 'photo')[0]
         if args.output_filename is None:
             output_filename = photo.name
         else:
             output_filename = args.output_filename
-        with open(output_filename, 'wb') as output_file:
-            for data in yi.get_file(photo):
-                output_file.write(data)
+        yi.save_file(photo, output_filename)
         print("Snapshot saved to: {}".format(output_filename))
+elif args.command == "sync":
+    with YIDashcam(Mode.file, metrics=metrics, **connection) as yi:
+        result = sync(yi, args.dest_dir, args.categories or CATEGORIES,
+                      delete=args.delete, max_workers=args.max_workers,
+                      limiter=BandwidthLimiter(
+                          args.bandwidth and args.bandwidth * 1e6),
+                      catalog=catalog,
+                      progress=lambda progress: print(
+                          format_progress(progress), end="\r"))
+    print("Downloaded {0}, unchanged {1}, deleted {2}, failed {3}".format(
+        len(result.downloaded), len(result.unchanged), len(result.deleted),
+        len(result.failed)))
+    for file, error in result.failed.items():
+        print("Error with {0}: {1}".format(file.path, error))
+    if result.failed:
+        sys.exit(1)
+elif args.command == "fleet":
+    from .fleet import Fleet
+    with Fleet(bandwidth=args.bandwidth and args.bandwidth * 1e6,
+               camera_bandwidth=args.camera_bandwidth
+               and args.camera_bandwidth * 1e6,
+               catalog=catalog, metrics=metrics, snapshot=snapshot) as fleet:
+        for address, result in sorted(
+                fleet.discover(args.addresses).items()):
+            if isinstance(result, Exception):
+                print("No dashcam at {0}: {1}".format(address, result))
+        results = fleet.offload(
+            args.dest_dir, args.categories or CATEGORIES,
+            delete=args.delete, max_workers=args.max_workers,
+            progress=lambda report: print(
+                "{0} dashcams: {1:.1f} MB at {2:.2f} MB/s".format(
+                    len(report.cameras), report.transferred / 1e6,
+                    report.rate / 1e6), end="\r"))
+        print(fleet.report())
+    if not results or any(isinstance(result, Exception) or result.failed
+                          for result in results.values()):
+        sys.exit(1)
+elif args.command == "history":
+    entries = catalog.files(
+        args.serial_number, args.category, args.start, args.end,
+        local=True if args.local else None, limit=args.limit)
+    for entry in entries:
+        print(format_entry(entry))
 elif args.command == "webapp":
     from . import webapp
-    with YIDashcam(None) as yi:
+    webapp.app.config['LOCAL_FILE_DIRS'] = args.local_dirs
+    webapp.catalog = catalog
+    if metrics is not None:
+        webapp.metrics = metrics  # Also served at /metrics
+    with YIDashcam(None, metrics=webapp.metrics, **connection) as yi:
         webapp.yi = yi
         webapp.app.run()
@@ -0,0 +1,448 @@
+"""Asyncio based client for Xiaomi YI Dashcam (requires aiohttp)"""
+
+import asyncio
+import datetime
+import logging
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+
+import aiohttp
+
+from . import Command, DEFAULT_TIMEOUTS, FILE_LIST_CHUNK_SIZE, \
+    HEARTBEAT_INTERVAL, Mode, READY_POLL_INTERVAL, READY_TIMEOUT, \
+    STREAM_CHUNK_SIZE, YIDashcam, YIDashcamConnectionException, \
+    YIDashcamDeleteException, YIDashcamException, YIDashcamFile, \
+    _COMMAND_TIMEOUT_CLASS, _FileListParser, _chunk_range, \
+    _command_params, _config_value, _delete_order, _parse_card_info, \
+    _parse_cmd_response, _parse_config
+from . import config
+from .index import FileIndex
+
+_LOG = logging.getLogger(__name__)
+
+
+def _client_timeout(timeout):
+    """Convert timeout as used by `requests` to `aiohttp.ClientTimeout`"""
+    try:
+        connect, read = timeout
+    except TypeError:
+        connect = read = timeout
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect,
+                                 sock_read=read)
+
+
+class AsyncYIDashcam():
+    """Asyncio based class to interact with Xiaomi YI Dashcam
+
+    Offers the same commands as `YIDashcam`, as coroutines, with downloads
+    as async iterators. Connect with `connect`, or use as an async context
+    manager to connect in `mode` on entry. Other arguments are as for
+    `YIDashcam`."""
+    HOST = YIDashcam.HOST
+    PORT = YIDashcam.PORT
+    HEARTBEAT_PORT = YIDashcam.HEARTBEAT_PORT
+
+    def __init__(self, mode=Mode.video, host=None, port=None,
+                 heartbeat_port=None, pool_size=4, timeouts=None):
+        self.host = host or self.HOST
+        self.port = port or self.PORT
+        self.heartbeat_port = heartbeat_port or self.HEARTBEAT_PORT
+        self.pool_size = pool_size
+        self.timeouts = DEFAULT_TIMEOUTS.copy()
+        if timeouts is not None:
+            self.timeouts.update(timeouts)
+        self._initial_mode = mode
+        self._session = None
+        self._config = None
+        self._file_index = None
+        self._mode = None
+        self._heartbeat_task = None
+        self._heartbeat_writer = None
+
+    async def __aenter__(self):
+        if self._initial_mode is not None:
+            await self.connect(self._initial_mode)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.disconnect()
+        await self.close()
+
+    async def close(self):
+        """Close HTTP session, once finished with dashcam"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _request(self, cmd, path="/", par=None, headers=None,
+                       **kwargs):
+        """Send a command to the dashcam, returning the HTTP response
+
+        Response must be released by caller"""
+        if not self.connected and cmd not in (Command.connect, Command.mode):
+            raise YIDashcamException("Dashcam not connected")
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size))
+
+        url = "{}/{}".format(self.base_url, path.lstrip("/"))
+        timeout = self.timeouts[_COMMAND_TIMEOUT_CLASS.get(cmd, 'command')]
+        try:
+            res = await self._session.get(
+                url, params=_command_params(cmd, par, **kwargs),
+                headers=headers, timeout=_client_timeout(timeout))
+            _LOG.debug("Sent dashcam command URL: %s", res.url)
+            res.raise_for_status()
+        except aiohttp.ClientResponseError:
+            res.release()
+            raise YIDashcamException("Bad response to command")
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            raise YIDashcamException("Failed to send command")
+        return res
+
+    async def _send_cmd(self, cmd, path="/", par=None, **kwargs):
+        """Send a command to the dashcam"""
+        async with await self._request(cmd, path, par=par, **kwargs) as res:
+            try:
+                text = await res.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                raise YIDashcamException("Failed to send command")
+            try:
+                return _parse_cmd_response(
+                    cmd, path, res.headers.get('Content-Type'), text)
+            except YIDashcamConnectionException:
+                self._lost_connection()
+                raise
+
+    async def _iter_data(self, res, chunk_size):
+        """Iterate over response body, in chunks of up to `chunk_size`"""
+        try:
+            async for data in res.content.iter_chunked(chunk_size):
+                yield data
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            raise YIDashcamException("Transfer failed: {}".format(err))
+
+    def _lost_connection(self):
+        """Update state after connection lost"""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        self._mode = None
+
+    async def _heartbeat(self):
+        """Send periodic heartbeat to dashcam"""
+        try:
+            while True:
+                self._heartbeat_writer.write(b"02:001:0")
+                await self._heartbeat_writer.drain()
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+        except OSError:
+            _LOG.debug("Heartbeat failed", exc_info=True)
+            self._heartbeat_task = None
+            self._mode = None
+
+    @property
+    def base_url(self):
+        """Base URL for HTTP requests to dashcam"""
+        if self.port == 80:
+            return "http://{}".format(self.host)
+        return "http://{}:{}".format(self.host, self.port)
+
+    @property
+    def connected(self):
+        """Status of connection to dashcam"""
+        return self._mode is not None
+
+    @property
+    def mode(self):
+        """Current mode dashcam is in"""
+        return self._mode
+
+    async def set_mode(self, mode):
+        """Enter dashcam mode"""
+        mode = Mode(mode)
+        try:
+            await self._send_cmd(Command.mode, par=mode)
+        except YIDashcamException as err:
+            raise YIDashcamException("Error entering mode {}".format(err))
+        self._mode = mode
+        if self._mode == Mode.file:
+            self._file_index = None  # Cache now potentially wrong
+
+    async def connect(self, mode=Mode.video):
+        """Connect to dashcam"""
+        if self.connected:
+            raise YIDashcamException("Already connected")
+        mode = Mode(mode)
+
+        try:
+            await self._send_cmd(Command.connect)
+        except YIDashcamException:
+            raise YIDashcamConnectionException("Failed to connect")
+
+        try:
+            _, self._heartbeat_writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.heartbeat_port), 10)
+        except (OSError, asyncio.TimeoutError):
+            raise YIDashcamConnectionException("Failed to connect")
+        self._heartbeat_task = asyncio.ensure_future(self._heartbeat())
+
+        self._config = None
+        self._file_index = None
+        await self.set_mode(mode)
+        _LOG.debug("Connected to dashcam")
+
+    async def disconnect(self):
+        """Disconnect from dashcam"""
+        if self.connected:
+            self._heartbeat_task.cancel()
+            try:
+                self._heartbeat_writer.close()
+                # Doesn't matter if we fail here, as dash cam will disconnect
+                # itself without a heartbeat.
+                await self._send_cmd(Command.disconnect)
+            except (OSError, YIDashcamException):
+                _LOG.debug("Error disconnecting", exc_info=True)
+            finally:
+                self._mode = None
+
+    async def card_info(self):
+        """Information of SD Card in dashcam"""
+        return _parse_card_info(await self._send_cmd(Command.card_info))
+
+    async def config(self):
+        """Config from dashcam"""
+        if self._config is None:
+            self._config = _parse_config(await self._send_cmd(Command.config))
+        return self._config.copy()
+
+    async def set_config(self, option, value):
+        """Set a configuration option on the dashcam
+
+        Many options can't changed without being in "video" mode with recording
+        stopped, so method will do this first (see `apply_config`)"""
+        await self.apply_config({option: value})
+
+    async def apply_config(self, values, timeout=READY_TIMEOUT):
+        """Set several configuration options on the dashcam at once
+
+        As `YIDashcam.apply_config`"""
+        values = {option: _config_value(option, value)
+                  for option, value in values.items()}
+        if self._config is not None:
+            values = {option: value for option, value in values.items()
+                      if self._config.get(option) != value}
+        if not values:
+            return
+        deadline = time.monotonic() + timeout
+        previous_mode = self.mode
+        if previous_mode != Mode.video:
+            # Must be in "video" mode to change (most) config options
+            await self.set_mode(Mode.video)
+        was_recording = await self._until_ready(self.recording, deadline)
+        if was_recording:
+            await self._until_ready(self.stop_record, deadline)
+
+        for option, value in values.items():
+            await self._until_ready(
+                lambda: self._send_cmd(option, par=value), deadline)
+            if self._config is not None:
+                self._config[option] = value
+
+        if previous_mode != Mode.video:
+            await self.set_mode(previous_mode)
+        elif was_recording:
+            await self._until_ready(self.start_record, deadline,
+                                    stop_recording=False)
+
+    async def _until_ready(self, func, deadline, stop_recording=True):
+        """Await `func` until accepted by the dashcam, or `deadline` passes
+
+        As `YIDashcam._until_ready`"""
+        while True:
+            try:
+                return await func()
+            except YIDashcamConnectionException:
+                raise
+            except YIDashcamException:
+                if time.monotonic() >= deadline:
+                    raise
+            await asyncio.sleep(READY_POLL_INTERVAL)
+            if not stop_recording:
+                continue
+            try:
+                if await self.recording():
+                    await self.stop_record()
+            except YIDashcamConnectionException:
+                raise
+            except YIDashcamException:
+                pass  # Not ready yet
+
+    async def serial_number(self):
+        """Serial number of dash cam"""
+        return (await self.config())[config.Option.serial_number]
+
+    async def set_clock(self, date_time=None):
+        """Set clock on dashcam to specified time (default: 'now')"""
+        if date_time is None:
+            date_time = datetime.datetime.now()
+        await self._send_cmd(
+            Command.clock, str=date_time.strftime("%Y-%m-%d_%H:%M:%S"))
+
+    async def iter_files(self):
+        """Iterate over files on dashcam SD Card
+
+        If the file list isn't cached, files are yielded as the listing is
+        streamed from the dashcam, and cached once the listing is complete.
+        Otherwise files are yielded from the cache, oldest first."""
+        if self._file_index is not None:
+            for file in self._file_index.files():
+                yield file
+            return
+        if self.mode != Mode.file:
+            await self.set_mode(Mode.file)
+        _LOG.debug("Fetching file list from dash cam")
+        files = []
+        parser = _FileListParser()
+        async with await self._request(Command.file_list) as res:
+            try:
+                async for chunk in self._iter_data(res, FILE_LIST_CHUNK_SIZE):
+                    for file in parser.feed(chunk):
+                        files.append(file)
+                        yield file
+                for file in parser.close():
+                    files.append(file)
+                    yield file
+            except YIDashcamConnectionException:
+                self._lost_connection()  # Raised by parser on bad status
+                raise
+            except (ET.ParseError, KeyError, ValueError):
+                raise YIDashcamException("Bad file list from dashcam")
+        self._file_index = FileIndex(files)
+
+    async def file_index(self):
+        """Time ordered `FileIndex` of files on dashcam SD Card"""
+        if self._file_index is None:
+            async for _ in self.iter_files():
+                pass
+        return self._file_index
+
+    async def file_list(self, category=None):
+        """List of files on dashcam SD Card, optionally only in `category`"""
+        return (await self.file_index()).files(category)
+
+    async def files_between(self, start, end, category=None):
+        """List of files on dashcam SD Card from `start` until `end` time
+
+        Optionally limited to files in `category`. Files are oldest first."""
+        return (await self.file_index()).files_between(start, end, category)
+
+    async def latest(self, n=1, category=None):
+        """List of `n` most recent files on dashcam SD Card, newest first
+
+        Optionally limited to files in `category`."""
+        return (await self.file_index()).latest(n, category)
+
+    async def get_thumbnail(self, path, chunk_size=STREAM_CHUNK_SIZE):
+        """Get a thumbnail for specified file on dashcam SD Card
+
+        Returns async iterator for data, in chunks of up to `chunk_size`
+        bytes"""
+        try:
+            path = path.url_path
+        except AttributeError:
+            path = YIDashcamFile._url_path(path)
+        async with await self._request(Command.file_thumbnail, path) as res:
+            async for data in self._iter_data(res, chunk_size):
+                yield data
+
+    async def get_file(self, path, start=0, end=None,
+                       chunk_size=STREAM_CHUNK_SIZE):
+        """Get the specified file from the dashcam SD Card
+
+        Part of the file can be fetched, from byte `start` up to and including
+        `end`, using a HTTP Range request. If the dashcam ignores the range,
+        data outside of it is discarded.
+
+        Returns async iterator for data, in chunks of up to `chunk_size`
+        bytes"""
+        try:
+            path = path.url_path
+        except AttributeError:
+            path = YIDashcamFile._url_path(path)
+        headers = None
+        if start or end is not None:
+            headers = {'Range': "bytes={}-{}".format(
+                start, "" if end is None else end)}
+        async with await self._request(Command.file_get, path,
+                                       headers=headers) as res:
+            if headers is None or res.status == 206:
+                async for data in self._iter_data(res, chunk_size):
+                    yield data
+                return
+            _LOG.debug("Range ignored by dashcam for %s", path)
+            offset = 0  # Same as `_byte_range`, for async iterator
+            async for chunk in self._iter_data(res, chunk_size):
+                data, done = _chunk_range(chunk, offset, start, end)
+                offset += len(chunk)
+                if data:
+                    yield data
+                if done:
+                    return
+
+    async def delete_file(self, path, force=False):
+        """Delete specified file from the dashcam SD Card
+
+        Its "_s" companion, if any, is also deleted (see `delete_files`)"""
+        try:
+            await self.delete_files([path], force)
+        except YIDashcamDeleteException as err:
+            raise next(iter(err.failed.values()))
+
+    async def delete_files(self, files, force=False):
+        """Delete `files` (or paths) from the dashcam SD Card
+
+        See `YIDashcam.delete_files`"""
+        deletes = _delete_order(files, await self.file_index())
+        deleted = []
+        failed = OrderedDict()
+        for index, (path, main) in enumerate(deletes):
+            if main in failed:
+                continue  # Keep companion of clip which wasn't deleted
+            try:
+                await self._send_cmd(
+                    Command.file_force_delete if force
+                    else Command.file_delete, str=path)
+            except YIDashcamConnectionException as err:
+                # No point trying the rest
+                failed.update(
+                    (remaining[0], err) for remaining in deletes[index:])
+                break
+            except YIDashcamException as err:
+                _LOG.debug("Failed to delete %s", path, exc_info=True)
+                failed[path] = err
+            else:
+                deleted.append(path)
+                if self._file_index is not None:
+                    self._file_index.remove(path)
+        if failed:
+            raise YIDashcamDeleteException(
+                "Failed to delete {} of {} files".format(
+                    len(failed), len(deletes)),
+                deleted, failed)
+        return deleted
+
+    async def recording(self):
+        """Is the dashcam actively recording"""
+        return bool(int(await self._send_cmd(Command.video_state)))
+
+    async def start_record(self):
+        """Start video recording"""
+        if self.mode != Mode.video:
+            await self.set_mode(Mode.video)
+        await self._send_cmd(Command.video_record, par=1)
+
+    async def stop_record(self):
+        """Stop video recording"""
+        await self._send_cmd(Command.video_record, par=0)
@@ -0,0 +1,40 @@
+"""Limiting bandwidth used transferring files from YI Dashcam"""
+
+import threading
+import time
+
+
+class BandwidthLimiter():
+    """Limits data to `rate` bytes per second, shared between threads
+
+    Up to `burst` bytes (default: a tenth of a second's worth) can be
+    transferred at once after being idle. If `parent` is given, its limit
+    also applies, so a limiter per dashcam can share an overall limit. A
+    `rate` of `None` applies no limit of its own."""
+
+    def __init__(self, rate=None, burst=None, parent=None):
+        self.rate = rate
+        self.burst = (rate or 0) / 10 if burst is None else burst
+        self.parent = parent
+        self._lock = threading.Lock()
+        self._free = 0  # Time by which data reserved so far is allowed
+
+    def _reserve(self, size):
+        """Reserve time for `size` bytes, returning delay before sending"""
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            start = max(now - self.burst / self.rate, self._free)
+            self._free = start + size / self.rate
+            return max(self._free - now, 0)
+
+    def consume(self, size):
+        """Wait until `size` bytes can be transferred within limits"""
+        delay = 0
+        limiter = self
+        while limiter is not None:
+            delay = max(delay, limiter._reserve(size))
+            limiter = limiter.parent
+        if delay:
+            time.sleep(delay)
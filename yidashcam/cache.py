@@ -0,0 +1,102 @@
+"""On-disk cache of YI Dashcam file thumbnails"""
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+_LOG = logging.getLogger(__name__)
+
+
+class ThumbnailCache():
+    """Size bounded, least recently used, cache of thumbnails on disk
+
+    Thumbnails are keyed by file path, size and time, so a new file at the
+    same path isn't served a stale thumbnail. Entries already in `directory`
+    are reused, oldest accessed evicted first."""
+
+    def __init__(self, directory, max_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = 0
+        self._entries = OrderedDict()  # key: size, least recent first
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith(".jpg") and os.path.isfile(path):
+                stat = os.stat(path)
+                entries.append((stat.st_atime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    @staticmethod
+    def key(file):
+        """Cache key, also suitable as an ETag, for thumbnail of `file`"""
+        return hashlib.sha1("{0.path}|{0.size}|{0.time:%Y%m%d%H%M%S}".format(
+            file).encode()).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, "{}.jpg".format(key))
+
+    def _remove(self, key):
+        self.size -= self._entries.pop(key)
+        try:
+            os.remove(self._filename(key))
+        except OSError:
+            _LOG.debug("Failed to remove thumbnail %s", key, exc_info=True)
+
+    def _evict(self):
+        while self.size > self.max_size and self._entries:
+            self._remove(next(iter(self._entries)))
+
+    def __contains__(self, file):
+        return self.key(file) in self._entries
+
+    def get(self, file):
+        """Cached thumbnail data for `file`, or `None` if not cached"""
+        key = self.key(file)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        try:
+            with open(self._filename(key), 'rb') as thumbnail_file:
+                return thumbnail_file.read()
+        except OSError:
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+            return None
+
+    def put(self, file, data):
+        """Add thumbnail `data` for `file` to the cache"""
+        key = self.key(file)
+        filename = self._filename(key)
+        tmp_filename = "{}.{}.tmp".format(filename, threading.get_ident())
+        with open(tmp_filename, 'wb') as thumbnail_file:
+            thumbnail_file.write(data)
+        os.replace(tmp_filename, filename)
+        with self._lock:
+            self.size += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._evict()
+
+    def discard(self, file):
+        """Remove thumbnail for `file` from cache, if present"""
+        key = self.key(file)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def fetch(self, yi, file):
+        """Thumbnail data for `file`, from cache or else dashcam `yi`"""
+        data = self.get(file)
+        if data is None:
+            data = yi.get_thumbnail_bytes(file)
+            self.put(file, data)
+        return data
@@ -0,0 +1,255 @@
+"""Catalog of YI Dashcam files seen on dashcams and downloaded, in SQLite"""
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from . import YIDashcamFile
+
+_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    serial_number TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    time TEXT NOT NULL,
+    read_only INTEGER NOT NULL,
+    category TEXT,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    on_camera INTEGER NOT NULL,
+    local_path TEXT,
+    downloaded REAL,
+    UNIQUE (serial_number, path, time)
+);
+CREATE INDEX IF NOT EXISTS files_serial_time
+    ON files (serial_number, time);
+CREATE INDEX IF NOT EXISTS files_serial_category_time
+    ON files (serial_number, category, time);
+CREATE INDEX IF NOT EXISTS files_category_time ON files (category, time);
+CREATE INDEX IF NOT EXISTS files_time ON files (time);
+"""
+
+_COLUMNS = ("id, serial_number, name, path, size, time, read_only, category, "
+            "first_seen, last_seen, on_camera, local_path, downloaded")
+
+
+class CatalogEntry(
+        namedtuple('CatalogEntry',
+                   ['id', 'serial_number', 'file', 'first_seen', 'last_seen',
+                    'on_camera', 'local_path', 'downloaded'])):
+    """File from dashcam with `serial_number`, as recorded in a `Catalog`
+
+    `file` is the `YIDashcamFile`, first and last seen in a listing at
+    `first_seen` and `last_seen`, and `on_camera` if in the latest listing.
+    `local_path` is where it was `downloaded` to, if it has been."""
+    __slots__ = ()
+
+
+def _format_time(time_):
+    return time_.strftime(_TIME_FORMAT)
+
+
+def _timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.datetime.fromtimestamp(timestamp)
+
+
+def parse_time(text, end=False):
+    """Time from "YYYY-MM-DD[ HH:MM[:SS]]" `text`
+
+    If only a date is given, this is the start of the day, or the end of the
+    day if `end` (i.e. start of the next day). Raises `ValueError` if
+    invalid."""
+    text = text.strip().replace("T", " ")
+    for time_format in (_TIME_FORMAT, "%Y-%m-%d %H:%M"):
+        try:
+            return datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            pass
+    time_ = datetime.datetime.strptime(text, "%Y-%m-%d")
+    return time_ + datetime.timedelta(days=1) if end else time_
+
+
+class Catalog():
+    """Catalog of files seen on dashcams and downloaded, stored in SQLite
+
+    Files are keyed by dashcam serial number, path and time, and indexed by
+    serial number, category and time, so can be queried by time range
+    without a connection to the dashcam. Listings are recorded with
+    `record_listing` (or changes to them with `record_changes`), and
+    downloads with `record_download`. Can be shared
+    between threads, and `path` by several processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Close database"""
+        with self._lock:
+            self._db.close()
+
+    @staticmethod
+    def _row(file, serial_number, seen):
+        return (serial_number, file.path, file.name, file.size,
+                _format_time(file.time), int(file.read_only), file.category,
+                seen, seen)
+
+    def _insert(self, rows):
+        self._db.executemany(
+            "INSERT OR IGNORE INTO files (serial_number, path, name, size, "
+            "time, read_only, category, first_seen, last_seen, on_camera) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)", rows)
+
+    def _update_seen(self, rows, serial_number, seen):
+        self._db.executemany(
+            "UPDATE files SET size = ?, read_only = ?, last_seen = ?, "
+            "on_camera = 1 "
+            "WHERE serial_number = ? AND path = ? AND time = ?",
+            [(row[3], row[5], seen, serial_number, row[1], row[4])
+             for row in rows])
+
+    def record_listing(self, serial_number, files):
+        """Record complete list of `files` on dashcam with `serial_number`
+
+        Files previously recorded but not listed are marked as no longer on
+        the dashcam."""
+        seen = time.time()
+        rows = [self._row(file, serial_number, seen) for file in files]
+        with self._lock, self._db:
+            self._insert(rows)
+            self._update_seen(rows, serial_number, seen)
+            self._db.execute(
+                "UPDATE files SET on_camera = 0 "
+                "WHERE serial_number = ? AND on_camera = 1 "
+                "AND last_seen != ?", (serial_number, seen))
+
+    def record_changes(self, serial_number, added, removed):
+        """Record changes to list of files on dashcam with `serial_number`
+
+        `added` files (including those changed) are recorded as on the
+        dashcam, and any others at the same path, along with files at
+        `removed` paths, as no longer on it. Unlike `record_listing`, files
+        otherwise unchanged aren't touched."""
+        seen = time.time()
+        rows = [self._row(file, serial_number, seen) for file in added]
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE files SET on_camera = 0 "
+                "WHERE serial_number = ? AND path = ? AND on_camera = 1",
+                [(serial_number, path) for path in removed]
+                + [(serial_number, row[1]) for row in rows])
+            self._insert(rows)
+            self._update_seen(rows, serial_number, seen)
+
+    def record_download(self, serial_number, file, local_path):
+        """Record `file` from dashcam with `serial_number` being downloaded
+        to `local_path`"""
+        seen = time.time()
+        with self._lock, self._db:
+            self._insert([self._row(file, serial_number, seen)])
+            self._db.execute(
+                "UPDATE files SET local_path = ?, downloaded = ? "
+                "WHERE serial_number = ? AND path = ? AND time = ?",
+                (os.path.abspath(local_path), seen, serial_number,
+                 file.path, _format_time(file.time)))
+
+    def record_deleted(self, serial_number, paths):
+        """Record files with `paths` being deleted from dashcam with
+        `serial_number`"""
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE files SET on_camera = 0 "
+                "WHERE serial_number = ? AND path = ? AND on_camera = 1",
+                [(serial_number, path) for path in paths])
+
+    @staticmethod
+    def _entry(row):
+        return CatalogEntry(
+            row[0], row[1],
+            YIDashcamFile(row[2], row[3], row[4],
+                          datetime.datetime.strptime(row[5], _TIME_FORMAT),
+                          bool(row[6])),
+            _timestamp(row[8]), _timestamp(row[9]), bool(row[10]), row[11],
+            _timestamp(row[12]))
+
+    @staticmethod
+    def _where(serial_number, category, start, end, on_camera, local):
+        clauses = []
+        params = []
+        for clause, value in (("serial_number = ?", serial_number),
+                              ("category = ?", category),
+                              ("time >= ?", start and _format_time(start)),
+                              ("time < ?", end and _format_time(end)),
+                              ("on_camera = ?", on_camera)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        if local is not None:
+            clauses.append("local_path IS {}NULL".format(
+                "NOT " if local else ""))
+        if not clauses:
+            return "", params
+        return " WHERE {}".format(" AND ".join(clauses)), params
+
+    def files(self, serial_number=None, category=None, start=None, end=None,
+              on_camera=None, local=None, limit=None, offset=0):
+        """List of `CatalogEntry`, newest first
+
+        Optionally only those from dashcam with `serial_number`, in
+        `category`, with time at or after `start` and before `end`, which
+        are (or aren't) `on_camera`, or have (or haven't) a `local` copy.
+        Up to `limit` entries are returned, after skipping `offset`."""
+        where, params = self._where(
+            serial_number, category, start, end, on_camera, local)
+        query = "SELECT {} FROM files{} ORDER BY time DESC, path DESC".format(
+            _COLUMNS, where)
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params.extend((-1 if limit is None else limit, offset))
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def count(self, serial_number=None, category=None, start=None, end=None,
+              on_camera=None, local=None):
+        """Number of files, optionally only those matching (see `files`)"""
+        where, params = self._where(
+            serial_number, category, start, end, on_camera, local)
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM files{}".format(where),
+                params).fetchone()[0]
+
+    def get(self, entry_id):
+        """`CatalogEntry` with `entry_id`, or `None` if not found"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT {} FROM files WHERE id = ?".format(_COLUMNS),
+                (entry_id, )).fetchone()
+        return None if row is None else self._entry(row)
+
+    def serial_numbers(self):
+        """Sorted list of serial numbers of dashcams in catalog"""
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                "SELECT DISTINCT serial_number FROM files "
+                "ORDER BY serial_number")]
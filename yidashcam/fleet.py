@@ -0,0 +1,293 @@
+"""Managing many YI Dashcams at once, keyed by serial number"""
+
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from . import CATEGORIES, Mode, YIDashcam, YIDashcamConnectionException, \
+    YIDashcamException
+from .bandwidth import BandwidthLimiter
+from .heartbeat import Health
+from .sync import sync
+
+_LOG = logging.getLogger(__name__)
+
+
+class CameraStatus(
+        namedtuple('CameraStatus',
+                   ['serial_number', 'address', 'health', 'state',
+                    'transferred', 'rate', 'result', 'error'])):
+    """Status of a dashcam in a `Fleet`, found at `address`
+
+    `state` is one of "idle", "offloading", "done" or "failed".
+    `transferred` bytes and `rate` (bytes per second) are for the current
+    or last offload, and `result` its `SyncResult`. `error` is the last
+    error, if any."""
+    __slots__ = ()
+
+
+class FleetReport(
+        namedtuple('FleetReport',
+                   ['cameras', 'transferred', 'rate', 'downloaded',
+                    'failed'])):
+    """Aggregated status of a `Fleet`
+
+    `cameras` maps serial numbers to `CameraStatus`. `transferred` bytes
+    and `rate` (bytes per second) are totals across all dashcams, as are
+    numbers of files `downloaded` and `failed`."""
+    __slots__ = ()
+
+    def __str__(self):
+        lines = ["{:<14} {:<21} {:<12} {:<10} {:>8} {:>7} {:>6}".format(
+            "Serial", "Address", "Health", "State", "MB", "MB/s", "Failed")]
+        for serial, status in sorted(self.cameras.items()):
+            lines.append(
+                "{:<14} {:<21} {:<12} {:<10} {:>8.1f} {:>7.2f} {:>6}".format(
+                    serial, status.address, status.health.name, status.state,
+                    status.transferred / 1e6, status.rate / 1e6,
+                    len(status.result.failed) if status.result else ""))
+            if status.error:
+                lines.append("    {}".format(status.error))
+        lines.append(
+            "{} dashcams: {:.1f} MB at {:.2f} MB/s, downloaded {}, "
+            "failed {}".format(
+                len(self.cameras), self.transferred / 1e6, self.rate / 1e6,
+                self.downloaded, self.failed))
+        return "\n".join(lines)
+
+
+def parse_address(address):
+    """Keyword arguments for `YIDashcam` from "host[:port[:heartbeat_port]]"
+    """
+    host, *ports = address.split(":")
+    kwargs = {'host': host}
+    for name, port in zip(('port', 'heartbeat_port'), ports):
+        if port:
+            kwargs[name] = int(port)
+    return kwargs
+
+
+class Fleet():
+    """Connections to many dashcams, keyed by serial number
+
+    Dashcams are found with `discover`, checked with `check_health` and
+    their files copied with `offload`, each run for all dashcams in
+    parallel on a pool of up to `max_workers` threads. Transfers from all
+    dashcams together are limited to `bandwidth` bytes per second, and from
+    each dashcam to `camera_bandwidth` (default: no limits). Offloads are
+    recorded in `catalog`, if given (see `sync`). Other keyword arguments
+    are passed to `YIDashcam` (e.g. `timeouts` or `metrics`).
+
+    Call `report` for a `FleetReport` of the status of all dashcams."""
+
+    def __init__(self, max_workers=8, bandwidth=None, camera_bandwidth=None,
+                 catalog=None, **kwargs):
+        self.camera_bandwidth = camera_bandwidth
+        self.catalog = catalog
+        self.limiter = BandwidthLimiter(bandwidth)
+        self._kwargs = kwargs
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        self._lock = threading.Lock()
+        self._cameras = {}
+        self._status = {}
+        self._start = self._end = None  # Times of last offload
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._cameras)
+
+    def __iter__(self):
+        return iter(list(self._cameras))
+
+    def __getitem__(self, serial_number):
+        return self._cameras[serial_number]
+
+    def close(self):
+        """Disconnect from all dashcams"""
+        self._executor.shutdown()
+        with self._lock:
+            cameras, self._cameras = self._cameras, {}
+            self._status.clear()
+        for yi in cameras.values():
+            yi.disconnect()
+
+    def _update(self, serial_number, **changes):
+        with self._lock:
+            self._status[serial_number] = \
+                self._status[serial_number]._replace(**changes)
+
+    def _map(self, func, items):
+        """Call `func` on each of `items` on pool, returning dict of item to
+        result or exception raised"""
+        futures = {self._executor.submit(func, item): item for item in items}
+        results = {}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (OSError, YIDashcamException) as err:
+                results[futures[future]] = err
+        return results
+
+    def _connect(self, address):
+        kwargs = dict(self._kwargs)
+        kwargs.update(parse_address(address))
+        yi = YIDashcam(Mode.file, **kwargs)
+        try:
+            return yi, yi.serial_number
+        except YIDashcamException:
+            yi.disconnect()
+            raise
+
+    def discover(self, addresses):
+        """Connect to dashcams at `addresses`, if not already connected
+
+        Each address is a "host[:port[:heartbeat_port]]" string. A dashcam
+        seen again at a new address replaces its old connection.
+
+        Returns dict of address to serial number, or exception if failed."""
+        with self._lock:
+            connected = {status.address for serial_number, status
+                         in self._status.items()
+                         if self._cameras[serial_number].connected}
+        addresses = [address for address in addresses
+                     if address not in connected]
+        found = {}
+        for address, result in self._map(self._connect, addresses).items():
+            if isinstance(result, Exception):
+                _LOG.debug("No dashcam at %s: %s", address, result)
+                found[address] = result
+                continue
+            yi, serial_number = result
+            with self._lock:
+                old = self._cameras.get(serial_number)
+                if old is not None and old.connected:
+                    duplicate = True  # Already found at another address
+                else:
+                    duplicate = False
+                    self._cameras[serial_number] = yi
+                    self._status[serial_number] = CameraStatus(
+                        serial_number, address, yi.health, 'idle', 0, 0,
+                        None, None)
+            if duplicate:
+                yi.disconnect()
+            elif old is not None:
+                old.disconnect()
+            found[address] = serial_number
+        return found
+
+    def _check(self, serial_number):
+        yi = self._cameras[serial_number]
+        try:
+            for attempt in range(2):
+                if not yi.connected:
+                    yi.connect(Mode.file)
+                try:
+                    yi.card_info  # Cheap command, to confirm it responds
+                except YIDashcamConnectionException:
+                    if attempt:
+                        raise  # Otherwise, lost since last used; reconnect
+                else:
+                    break
+        except YIDashcamException as err:
+            self._update(serial_number, health=yi.health, error=str(err))
+            raise
+        self._update(serial_number, health=yi.health, error=None)
+        return yi.health
+
+    def check_health(self):
+        """Check each dashcam responds, reconnecting any which have been lost
+
+        Returns dict of serial number to `Health`"""
+        return {serial_number: (result if isinstance(result, Health)
+                                else Health.lost)
+                for serial_number, result
+                in self._map(self._check, list(self._cameras)).items()}
+
+    def _offload(self, serial_number, dest_dir, categories, delete,
+                 max_workers, progress):
+        yi = self._cameras[serial_number]
+        limiter = BandwidthLimiter(self.camera_bandwidth, parent=self.limiter)
+        start = time.monotonic()
+        file_bytes = {}
+        self._update(serial_number, state='offloading', transferred=0,
+                     rate=0, result=None, error=None)
+
+        def camera_progress(file_progress):
+            with self._lock:
+                path = file_progress.file.path
+                transferred = self._status[serial_number].transferred + max(
+                    file_progress.file_bytes - file_bytes.get(path, 0), 0)
+                file_bytes[path] = file_progress.file_bytes
+                self._status[serial_number] = \
+                    self._status[serial_number]._replace(
+                        transferred=transferred,
+                        rate=transferred / max(time.monotonic() - start,
+                                               1e-6))
+            if progress is not None:
+                progress(self.report())
+
+        try:
+            if not yi.connected:
+                yi.connect(Mode.file)
+            result = sync(yi, os.path.join(dest_dir, serial_number),
+                          categories, delete=delete, max_workers=max_workers,
+                          progress=camera_progress, limiter=limiter,
+                          catalog=self.catalog)
+        except (OSError, YIDashcamException) as err:
+            _LOG.debug("Failed to offload %s", serial_number, exc_info=True)
+            self._update(serial_number, health=yi.health, state='failed',
+                         error=str(err))
+            raise
+        self._update(serial_number, health=yi.health,
+                     state='failed' if result.failed else 'done',
+                     result=result, error="Failed to download {} files"
+                     .format(len(result.failed)) if result.failed else None)
+        return result
+
+    def offload(self, dest_dir, categories=CATEGORIES, delete=False,
+                max_workers=2, progress=None):
+        """Copy files from all dashcams, each into `dest_dir`/serial number
+
+        Each dashcam is mirrored with `sync` (see for `categories` and
+        `delete`), transferring up to `max_workers` files at once from each
+        dashcam, within the bandwidth limits. If `progress` is given, it is
+        called with a `FleetReport` after each chunk is written, from the
+        worker threads.
+
+        Returns dict of serial number to `SyncResult`, or exception if
+        failed."""
+        self._start, self._end = time.monotonic(), None
+        try:
+            return self._map(
+                lambda serial_number: self._offload(
+                    serial_number, dest_dir, categories, delete, max_workers,
+                    progress),
+                list(self._cameras))
+        finally:
+            self._end = time.monotonic()
+
+    def report(self):
+        """`FleetReport` of status of all dashcams"""
+        with self._lock:
+            cameras = {serial_number: status._replace(
+                health=self._cameras[serial_number].health)
+                for serial_number, status in self._status.items()
+                if serial_number in self._cameras}
+        transferred = sum(status.transferred for status in cameras.values())
+        elapsed = ((self._end or time.monotonic()) - self._start
+                   if self._start else 0)
+        return FleetReport(
+            cameras, transferred,
+            transferred / elapsed if elapsed else 0,
+            sum(len(status.result.downloaded)
+                for status in cameras.values() if status.result),
+            sum(len(status.result.failed)
+                for status in cameras.values() if status.result))
@@ -0,0 +1,100 @@
+"""Heartbeat to keep connection with YI Dashcam alive, and monitor health"""
+
+import enum
+import logging
+import socket
+import threading
+import time
+
+_LOG = logging.getLogger(__name__)
+
+#: Message sent to dashcam as heartbeat
+HEARTBEAT_MESSAGE = b"02:001:0"
+
+
+@enum.unique
+class Health(enum.Enum):
+    """Health of connection with dashcam"""
+    disconnected = 'disconnected'
+    healthy = 'healthy'
+    degraded = 'degraded'  # Heartbeats being missed
+    lost = 'lost'
+
+
+class Heartbeat():
+    """Send heartbeats to dashcam from a single long-lived thread
+
+    Each heartbeat waits up to `reply_timeout` seconds for a reply, from
+    which round-trip `latency` is measured. Once the dashcam has replied,
+    heartbeats without a reply count as missed; after `max_missed` in a row
+    (or if the socket fails) the connection is considered lost, and the
+    thread stops. `callback`, if given, is called from the thread with the
+    new `Health` whenever it changes."""
+
+    def __init__(self, host, port, interval, reply_timeout=2, max_missed=3,
+                 callback=None):
+        self.interval = interval
+        self.reply_timeout = reply_timeout
+        self.max_missed = max_missed
+        self.callback = callback
+        self.latency = None
+        self.missed = 0
+        self.health = Health.healthy
+        self._replies = 0
+        self._stop = threading.Event()
+        self._sock = socket.create_connection((host, port), timeout=10)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._thread = threading.Thread(
+            target=self._run, name="YIDashcamHeartbeat", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending heartbeats, and close socket"""
+        self._stop.set()
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _set_health(self, health):
+        if health == self.health or self._stop.is_set():
+            return
+        _LOG.debug("Dashcam connection %s", health.name)
+        self.health = health
+        if self.callback is not None:
+            self.callback(health)
+
+    def _beat(self):
+        """Send heartbeat, returning `False` if socket failed"""
+        start = time.monotonic()
+        try:
+            self._sock.settimeout(self.reply_timeout)
+            self._sock.sendall(HEARTBEAT_MESSAGE)
+            reply = self._sock.recv(1024)
+        except socket.timeout:
+            if self._replies:
+                self.missed += 1
+            return True
+        except OSError:
+            _LOG.debug("Heartbeat failed", exc_info=True)
+            return False
+        if not reply:
+            _LOG.debug("Heartbeat socket closed by dashcam")
+            return False
+        self.latency = time.monotonic() - start
+        self._replies += 1
+        self.missed = 0
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            if not self._beat() or self.missed >= self.max_missed:
+                self._set_health(Health.lost)
+                return
+            self._set_health(
+                Health.degraded if self.missed else Health.healthy)
+            self._stop.wait(self.interval - (time.monotonic() - start))
@@ -0,0 +1,186 @@
+"""Time ordered index of YI Dashcam files"""
+
+import bisect
+import threading
+import uuid
+from collections import deque
+
+#: Number of changes kept by `FileIndex`, for `FileIndex.changes_since`
+CHANGE_LOG_SIZE = 1000
+
+
+class _SortedFiles():
+    """Files kept sorted by time, with path to break ties"""
+
+    def __init__(self, files=()):
+        files = sorted(files, key=lambda file: (file.time, file.path))
+        self.keys = [(file.time, file.path) for file in files]
+        self.files = files
+
+    def add(self, file):
+        key = (file.time, file.path)
+        index = bisect.bisect_left(self.keys, key)
+        self.keys.insert(index, key)
+        self.files.insert(index, file)
+
+    def remove(self, file):
+        index = bisect.bisect_left(self.keys, (file.time, file.path))
+        del self.keys[index]
+        del self.files[index]
+
+    def newer(self, key):
+        """Number of files after `key`"""
+        return len(self.keys) - bisect.bisect_right(self.keys, key)
+
+    def between(self, start, end):
+        return self.files[bisect.bisect_left(self.keys, (start, )):
+                          bisect.bisect_left(self.keys, (end, ))]
+
+
+class FileIndex():
+    """Index of dashcam files, sorted by time and partitioned by category
+
+    Files are keyed by `path`, so adding a file with the same path as an
+    existing one replaces it.
+
+    Each change increments `version`, and `tag` identifies the index and
+    version, so differs for any change or if the index is replaced (e.g.
+    when the file list is fetched again).
+
+    Changes can be made from several threads, and `changes_since` called
+    while they are being made."""
+
+    def __init__(self, files=()):
+        self.generation = uuid.uuid4().hex[:12]
+        self.version = 0
+        self._lock = threading.Lock()  # Held for changes
+        # (version, path, category) of changes, for `changes_since`
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._by_path = {file.path: file for file in files}
+        self._all = _SortedFiles(self._by_path.values())
+        categories = {}
+        for file in self._all.files:
+            categories.setdefault(file.category, []).append(file)
+        self._categories = {category: _SortedFiles(files)
+                            for category, files in categories.items()}
+
+    def __len__(self):
+        return len(self._by_path)
+
+    def __iter__(self):
+        return iter(self._all.files)
+
+    def __contains__(self, path):
+        return path in self._by_path
+
+    def _partition(self, category):
+        try:
+            return self._categories[category]
+        except KeyError:
+            return self._categories.setdefault(category, _SortedFiles())
+
+    def get(self, path, default=None):
+        """File with `path`, or `default` if not in index"""
+        return self._by_path.get(path, default)
+
+    def files(self, category=None):
+        """List of files, oldest first, optionally only in `category`"""
+        if category is None:
+            return self._all.files.copy()
+        return self._partition(category).files.copy()
+
+    @property
+    def tag(self):
+        """String identifying this index and its version"""
+        return "{}-{}".format(self.generation, self.version)
+
+    def _changed(self, file):
+        self.version += 1
+        self._changes.append((self.version, file.path, file.category))
+
+    def add(self, file):
+        """Add `file` to the index"""
+        with self._lock:
+            old = self._by_path.get(file.path)
+            if old == file:
+                return
+            if old is not None:
+                self._all.remove(old)
+                self._partition(old.category).remove(old)
+            self._by_path[file.path] = file
+            self._all.add(file)
+            self._partition(file.category).add(file)
+            self._changed(file)
+
+    def remove(self, path):
+        """Remove file with `path` from index, returning it if present"""
+        with self._lock:
+            file = self._by_path.pop(path, None)
+            if file is not None:
+                self._all.remove(file)
+                self._partition(file.category).remove(file)
+                self._changed(file)
+            return file
+
+    def changes_since(self, tag, category=None):
+        """Files added and paths removed since index had `tag`
+
+        Returns tuple of list of files (oldest first) and list of paths,
+        optionally only those in `category`. A changed file is included as
+        added. Returns `None` if `tag` is from another index, or too old for
+        the changes to still be known."""
+        generation, _, version = tag.rpartition("-")
+        try:
+            version = int(version)
+        except ValueError:
+            return None
+        if generation != self.generation:
+            return None
+        with self._lock:
+            if version > self.version \
+                    or version < self.version - len(self._changes):
+                return None
+            paths = {path for change_version, path, change_category
+                     in self._changes
+                     if change_version > version
+                     and (category is None or change_category == category)}
+            added = [self._by_path[path]
+                     for path in paths if path in self._by_path]
+            removed = [path for path in paths if path not in self._by_path]
+        added.sort(key=lambda file: (file.time, file.path))
+        return added, sorted(removed)
+
+    def files_between(self, start, end, category=None):
+        """List of files with time at or after `start` and before `end`
+
+        Optionally limited to files in `category`. Files are oldest first."""
+        if category is None:
+            return self._all.between(start, end)
+        return self._partition(category).between(start, end)
+
+    def count(self, category=None):
+        """Number of files, optionally only in `category`"""
+        if category is None:
+            return len(self._by_path)
+        return len(self._partition(category).files)
+
+    def latest(self, n=1, category=None, offset=0):
+        """List of up to `n` most recent files, newest first
+
+        Optionally limited to files in `category`, and skipping the `offset`
+        most recent. Only the files returned are copied, so this is cheap
+        for paging through a large index."""
+        files = self._all.files if category is None \
+            else self._partition(category).files
+        end = len(files) - offset
+        if n <= 0 or end <= 0:
+            return []
+        return files[max(end - n, 0):end][::-1]
+
+    def rank(self, time, path, category=None):
+        """Number of files newer than `time`, with `path` to break ties
+
+        This is the `offset` of a file with `time` and `path` in `latest`
+        (or where it would be, if not in the index)."""
+        files = self._all if category is None else self._partition(category)
+        return files.newer((time, path))
@@ -0,0 +1,169 @@
+"""Metrics on requests to YI Dashcam, in Prometheus text format or summary"""
+
+import bisect
+import threading
+from collections import Counter
+
+#: Upper bounds, in seconds, of command latency histogram buckets
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(**labels):
+    return ",".join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"'))
+        for name, value in sorted(labels.items()))
+
+
+class _Histogram():
+    __slots__ = ('buckets', 'sum', 'count', 'max')
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.sum = 0
+        self.count = 0
+        self.max = 0
+
+
+class Metrics():
+    """Collects metrics on requests to the dashcam
+
+    Pass to `YIDashcam` as `metrics` to enable collection. Records latency of
+    each command (or config option) as a histogram, errors by type, retries,
+    bytes and time transferring data, and hits and misses of cached data."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._errors = Counter()
+        self._retries = Counter()
+        self._transfer_bytes = Counter()
+        self._transfer_seconds = Counter()
+        self._cache = Counter()
+
+    def observe_command(self, command, seconds):
+        """Record `command` taking `seconds` to respond"""
+        with self._lock:
+            histogram = self._latency.get(command.name)
+            if histogram is None:
+                histogram = self._latency[command.name] = _Histogram(
+                    len(self.buckets))
+            index = bisect.bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                histogram.buckets[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+            histogram.max = max(histogram.max, seconds)
+
+    def record_error(self, command, error):
+        """Record `command` failing with `error` (exception or its name)"""
+        if isinstance(error, BaseException):
+            error = type(error).__name__
+        with self._lock:
+            self._errors[command.name, error] += 1
+
+    def record_retry(self, command):
+        """Record `command` being retried"""
+        with self._lock:
+            self._retries[command.name] += 1
+
+    def record_transfer(self, kind, size, seconds):
+        """Record `size` bytes of `kind` data transferred in `seconds`"""
+        with self._lock:
+            self._transfer_bytes[kind] += size
+            self._transfer_seconds[kind] += seconds
+
+    def record_cache(self, cache, hit):
+        """Record hit (or miss) on `cache`"""
+        with self._lock:
+            self._cache[cache, 'hit' if hit else 'miss'] += 1
+
+    def cache_hit_ratio(self, cache):
+        """Fraction of lookups of `cache` which were hits (or `None`)"""
+        with self._lock:
+            hits = self._cache[cache, 'hit']
+            total = hits + self._cache[cache, 'miss']
+        return hits / total if total else None
+
+    def prometheus(self):
+        """Metrics in Prometheus text exposition format"""
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            for suffix, labels, value in samples:
+                lines.append("{}{}{{{}}} {}".format(
+                    name, suffix, labels, value))
+
+        with self._lock:
+            samples = []
+            for command, histogram in sorted(self._latency.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram.buckets):
+                    cumulative += count
+                    samples.append(('_bucket', _labels(
+                        command=command, le=bound), cumulative))
+                samples.append(('_bucket', _labels(
+                    command=command, le="+Inf"), histogram.count))
+                samples.append(('_sum', _labels(command=command),
+                                histogram.sum))
+                samples.append(('_count', _labels(command=command),
+                                histogram.count))
+            metric("yidashcam_command_duration_seconds", "histogram",
+                   "Time for dashcam to respond to command", samples)
+            metric("yidashcam_command_errors_total", "counter",
+                   "Failed requests to dashcam, by type of error",
+                   [('', _labels(command=command, error=error), count)
+                    for (command, error), count
+                    in sorted(self._errors.items())])
+            metric("yidashcam_command_retries_total", "counter",
+                   "Requests to dashcam retried",
+                   [('', _labels(command=command), count)
+                    for command, count in sorted(self._retries.items())])
+            metric("yidashcam_transfer_bytes_total", "counter",
+                   "Data transferred from dashcam",
+                   [('', _labels(kind=kind), count) for kind, count
+                    in sorted(self._transfer_bytes.items())])
+            metric("yidashcam_transfer_seconds_total", "counter",
+                   "Time spent transferring data from dashcam",
+                   [('', _labels(kind=kind), count) for kind, count
+                    in sorted(self._transfer_seconds.items())])
+            metric("yidashcam_cache_requests_total", "counter",
+                   "Lookups of cached dashcam data",
+                   [('', _labels(cache=cache, result=result), count)
+                    for (cache, result), count
+                    in sorted(self._cache.items())])
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Human readable summary of metrics"""
+        with self._lock:
+            errors = Counter()
+            for (command, _), count in self._errors.items():
+                errors[command] += count
+            lines = ["{:<24} {:>6} {:>6} {:>7} {:>9} {:>9}".format(
+                "Command", "Count", "Errors", "Retries", "Mean (ms)",
+                "Max (ms)")]
+            for command in sorted(
+                    set(self._latency) | set(errors) | set(self._retries)):
+                histogram = self._latency.get(command, _Histogram(0))
+                lines.append(
+                    "{:<24} {:>6} {:>6} {:>7} {:>9.1f} {:>9.1f}".format(
+                        command, histogram.count, errors[command],
+                        self._retries[command],
+                        1000 * histogram.sum / (histogram.count or 1),
+                        1000 * histogram.max))
+            for kind, size in sorted(self._transfer_bytes.items()):
+                seconds = self._transfer_seconds[kind]
+                lines.append(
+                    "{} transfers: {:.1f} MB in {:.1f}s ({:.2f} MB/s)".format(
+                        kind, size / 1e6, seconds,
+                        size / 1e6 / seconds if seconds else 0))
+            for cache in sorted({cache for cache, _ in self._cache}):
+                hits = self._cache[cache, 'hit']
+                total = hits + self._cache[cache, 'miss']
+                lines.append("{} cache: {}/{} hits ({:.0%})".format(
+                    cache, hits, total, hits / total))
+        return "\n".join(lines)
@@ -0,0 +1,119 @@
+"""Serialized, prioritised sending of commands to YI Dashcam"""
+
+import concurrent.futures
+import contextlib
+import enum
+import heapq
+import itertools
+import threading
+
+
+@enum.unique
+class Priority(enum.IntEnum):
+    """Priority of commands sent to dashcam, lowest value sent first"""
+    interactive = 0
+    background = 1
+
+
+class CommandScheduler():
+    """Serialize commands to the dashcam, which only handles one at a time
+
+    Threads wait for the command slot in order of `Priority`, then arrival.
+    The slot is reentrant, so a sequence of commands (e.g. changing mode then
+    config) can be held as one. Priority defaults to `Priority.interactive`
+    and can be changed per thread with `priority`.
+
+    Identical read-only commands already in flight can be merged with
+    `single_flight`, so callers share one round-trip to the dashcam. Only
+    those at the same priority are merged, so interactive callers don't wait
+    on background ones."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._owner = None
+        self._depth = 0
+        self._local = threading.local()
+        self._flights_lock = threading.Lock()
+        self._flights = {}
+
+    @property
+    def current_priority(self):
+        """Priority of commands sent from the current thread"""
+        return getattr(self._local, 'priority', Priority.interactive)
+
+    @contextlib.contextmanager
+    def priority(self, priority):
+        """Context manager to send commands from this thread at `priority`"""
+        previous = self.current_priority
+        self._local.priority = Priority(priority)
+        try:
+            yield
+        finally:
+            self._local.priority = previous
+
+    def acquire(self):
+        """Wait for, and take, the command slot"""
+        thread = threading.get_ident()
+        with self._condition:
+            if self._owner == thread:
+                self._depth += 1
+                return
+            entry = (self.current_priority, next(self._counter))
+            heapq.heappush(self._waiting, entry)
+            try:
+                while self._owner is not None or self._waiting[0] != entry:
+                    self._condition.wait()
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._owner = thread
+            self._depth = 1
+
+    def release(self):
+        """Release the command slot"""
+        with self._condition:
+            if self._owner != threading.get_ident():
+                raise RuntimeError("Command slot not held by this thread")
+            self._depth -= 1
+            if self._depth == 0:
+                self._owner = None
+                self._condition.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    def single_flight(self, key, func):
+        """Call `func`, unless a call for `key` is already in flight at the
+        same priority, in which case wait for and share its result (or
+        exception)"""
+        if self._owner == threading.get_ident():
+            # In flight call may be waiting for the slot held by this thread
+            return func()
+        key = (self.current_priority, key)
+        with self._flights_lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = concurrent.futures.Future()
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
@@ -0,0 +1,628 @@
+#!/usr/bin/env python
+"""Simulated YI Dashcam, for development and testing without the real thing
+
+Run with: python -m yidashcam.simulator [options]
+"""
+
+import argparse
+import datetime
+import http.server
+import logging
+import ntpath
+import random
+import re
+import socket
+import socketserver
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from . import Command, Mode, _companion_path, _file_category
+from .config import Exposure, Option, option_map
+
+_LOG = logging.getLogger(__name__)
+
+#: Status returned to commands which succeed, fail, or are sent when the
+#: connection has been lost (or was never made)
+STATUS_OK = 0
+STATUS_FAILED = -1
+STATUS_LOST_CONNECTION = -256
+
+#: Rate, in bytes per second, at which simulated clips are recorded
+VIDEO_RATE = 2500000
+#: Clips recorded for less than this many seconds are discarded
+MIN_CLIP_SECONDS = 1
+#: Size, in bytes, of photos taken
+PHOTO_SIZE = 500000
+
+_THUMBNAIL = b"\xff\xd8" + bytes(8000) + b"\xff\xd9"
+_NOT_FOUND_PAGE = (b"<html><head><title>Page Not Found</title></head>"
+                   b"<body><h1>Page Not Found</h1></body></html>")
+_WRITE_SIZE = 64 * 1024
+_ZEROS = memoryview(bytes(_WRITE_SIZE))
+
+_DEFAULT_CONFIG = {
+    Option.audio: True,
+    Option.exposure: Exposure.auto,
+    Option.firmware_version: "1.0.0_SIM",
+    Option.model: "YI-SIM",
+    Option.video_auto_start: True,
+    Option.video_timestamp: True,
+}
+
+
+class SimulatedFile(
+        namedtuple('SimulatedFile', ['size', 'time', 'read_only',
+                                     'content'])):
+    """File on the simulated SD Card
+
+    Without `content`, the file is `size` zero bytes, which costs nothing to
+    store. `read_only` defaults to whether file is an emergency clip."""
+    __slots__ = ()
+
+    def __new__(cls, size, time, read_only=False, content=None):
+        if content is not None:
+            size = len(content)
+        return super().__new__(cls, size, time, read_only, content)
+
+    def iter_data(self, start=0, end=None):
+        """Content from `start` up to (not including) `end`, in chunks"""
+        end = self.size if end is None else min(end, self.size)
+        for offset in range(start, end, _WRITE_SIZE):
+            size = min(_WRITE_SIZE, end - offset)
+            if self.content is None:
+                yield _ZEROS[:size]
+            else:
+                yield self.content[offset:offset + size]
+
+
+def synthetic_files(count, size=1000000, start=0,
+                    time=datetime.datetime(2020, 1, 1)):
+    """Files for `SimulatedCamera`, spread across folders like a real card
+
+    Each roadmap clip is followed by its "_s" companion, then an emergency
+    clip and a photo, timestamped a minute apart from `time`."""
+    files = {}
+    for index in range(start, start + count):
+        kind = index % 4
+        if kind == 0:
+            path = "A:\\Movie\\{:06d}.MP4".format(index)
+        elif kind == 1:
+            path = _companion_path("A:\\Movie\\{:06d}.MP4".format(index - 1))
+        elif kind == 2:
+            path = "A:\\EMR\\{:06d}.MP4".format(index)
+        else:
+            path = "A:\\Photo\\{:06d}.JPG".format(index)
+        files[path] = SimulatedFile(
+            size, time + datetime.timedelta(minutes=index), kind == 2)
+    return files
+
+
+class Faults():
+    """Faults injected into responses from `SimulatedCamera`
+
+    Each rate is the probability (0 to 1) of the fault for each request.
+    `drop_rate` closes the connection without a reply. `truncate_rate` cuts
+    short a file or thumbnail transfer. `not_found_rate` replies with the
+    "page not found" HTML page the dashcam gives for missing files.
+    `lost_connection_rate` loses the dashcam's connection, so commands get
+    -256 status until connecting again.
+
+    Faults are drawn from a random generator seeded with `seed`, so are
+    reproducible for the same sequence of requests."""
+
+    def __init__(self, drop_rate=0, truncate_rate=0, not_found_rate=0,
+                 lost_connection_rate=0, seed=None):
+        self.drop_rate = drop_rate
+        self.truncate_rate = truncate_rate
+        self.not_found_rate = not_found_rate
+        self.lost_connection_rate = lost_connection_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def occurs(self, rate):
+        """Whether fault with probability `rate` occurs this time"""
+        if not rate:
+            return False
+        with self._lock:
+            return self._random.random() < rate
+
+    def fraction(self):
+        """Random fraction (0 to 1), e.g. of transfer completed"""
+        with self._lock:
+            return self._random.random()
+
+
+class _CommandFailed(Exception):
+    def __init__(self, status=STATUS_FAILED):
+        super().__init__(status)
+        self.status = status
+
+
+def _function_xml(cmd, status, extra=""):
+    return ('<?xml version="1.0" encoding="UTF-8" ?>\n<Function>\n'
+            '<Cmd>{}</Cmd>\n<Status>{}</Status>\n{}</Function>\n').format(
+                cmd, status, extra).encode()
+
+
+def _card_path(url_path):
+    """SD Card path for `url_path`"""
+    return "A:{}".format(unquote(url_path).replace("/", "\\"))
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Allow keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        _LOG.debug("%s %s", self.address_string(), format % args)
+
+    def drop(self):
+        """Close connection, without reply"""
+        self.close_connection = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def send_body(self, body, content_type, status=200, headers=(),
+                  size=None):
+        """Send `body` (bytes, or iterable of them totalling `size`)"""
+        camera = self.server.camera
+        if size is None:
+            size = len(body)
+            body = [body]
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        for header in headers:
+            self.send_header(*header)
+        self.end_headers()
+        limit = None
+        if content_type in ("image/jpeg", "application/octet-stream") \
+                and camera.faults.occurs(camera.faults.truncate_rate):
+            limit = int(size * camera.faults.fraction())
+        sent = 0
+        for data in body:
+            data = memoryview(data)
+            for offset in range(0, len(data), _WRITE_SIZE):
+                chunk = data[offset:offset + _WRITE_SIZE]
+                if limit is not None and sent + len(chunk) > limit:
+                    self.wfile.write(chunk[:limit - sent])
+                    _LOG.debug("Truncated transfer at %d of %d bytes",
+                               limit, size)
+                    self.drop()
+                    return
+                if camera.bandwidth:
+                    time.sleep(camera.reserve_bandwidth(len(chunk)))
+                self.wfile.write(chunk)
+                sent += len(chunk)
+
+    def send_not_found(self):
+        # Dashcam replies with HTML page, rather than 404 status
+        self.send_body(_NOT_FOUND_PAGE, "text/html")
+
+    def do_GET(self):
+        camera = self.server.camera
+        if camera.latency:
+            time.sleep(camera.latency)
+        if camera.faults.occurs(camera.faults.drop_rate):
+            self.drop()
+            return
+        if camera.faults.occurs(camera.faults.not_found_rate):
+            self.send_not_found()
+            return
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if 'custom' not in query:
+            self.send_file(url.path)
+            return
+        try:
+            cmd = int(query['cmd'][0])
+            par = int(query['par'][0]) if 'par' in query else None
+        except (KeyError, ValueError):
+            self.send_body(_function_xml(-1, STATUS_FAILED), "text/xml")
+            return
+        if camera.faults.occurs(camera.faults.lost_connection_rate):
+            camera.lose_connection()
+        content_type, body = camera.respond(
+            cmd, url.path, par, query.get('str', [None])[0])
+        if body is None:
+            self.send_not_found()
+        else:
+            self.send_body(body, content_type)
+
+    def send_file(self, url_path):
+        file = self.server.camera.files.get(_card_path(url_path))
+        if file is None:
+            self.send_not_found()
+            return
+        match = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if match and int(match.group(1)) < file.size:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or file.size - 1), file.size - 1)
+            self.send_body(
+                file.iter_data(start, end + 1), "application/octet-stream",
+                206, [("Content-Range", "bytes {}-{}/{}".format(
+                    start, end, file.size))], size=end + 1 - start)
+        else:
+            self.send_body(file.iter_data(), "application/octet-stream",
+                           size=file.size)
+
+
+class _HeartbeatHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        heartbeats = self.server.camera._heartbeats
+        heartbeats.add(self.request)
+        try:
+            while True:
+                data = self.request.recv(1024)
+                if not data:
+                    return
+                self.request.sendall(data)  # Reply, so latency is measured
+        except OSError:
+            return
+        finally:
+            heartbeats.discard(self.request)
+
+
+class _HeartbeatServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    camera = None
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    camera = None
+
+
+class SimulatedCamera():
+    """Stateful simulation of the dashcam's HTTP and heartbeat servers
+
+    Listens on `host`, `port` and `heartbeat_port` (default: ephemeral
+    ports, see `kwargs`) once started, or entered as a context manager.
+    `files` maps paths on the SD Card (e.g. "A:\\\\Movie\\\\x.MP4") to
+    `SimulatedFile`, and `config` overrides default config values.
+
+    Commands are handled as the dashcam does: they fail with -256 status
+    until connected; config can only be changed in "video" mode with
+    recording stopped; entering "video" mode starts recording if
+    `video_auto_start` is set; stopping recording saves the clip, with its
+    "_s" companion, and an emergency clip saves the current clip as a read
+    only emergency file. If `clip_length` is given, clips are also saved
+    every `clip_length` seconds while recording.
+
+    Each HTTP request is delayed by `latency` seconds, and response bodies
+    are sent at up to `bandwidth` bytes per second (default: unlimited),
+    shared by all connections. `faults` are injected as configured."""
+
+    def __init__(self, host="127.0.0.1", port=0, heartbeat_port=0,
+                 files=None, config=None, serial_number="SIM0000000001",
+                 capacity=32000000000, clip_length=None, latency=0,
+                 bandwidth=None, faults=None):
+        self.files = dict(files or {})
+        self.config = {
+            option: _DEFAULT_CONFIG.get(
+                option, "" if val_type is str else val_type(0)
+                if val_type is bool else next(iter(val_type)))
+            for option, val_type in option_map.items()}
+        self.config[Option.serial_number] = serial_number
+        self.config.update(config or {})
+        self.capacity = capacity
+        self.clip_length = clip_length
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.faults = faults or Faults()
+        self.connected = False
+        self.mode = None
+        self.recording = False
+        self.total_use = 0  # Files written
+        self._record_start = None
+        self._sequence = 0
+        self._clock_offset = datetime.timedelta(0)
+        self._lock = threading.RLock()
+        self._link_lock = threading.Lock()
+        self._link_free = 0  # Time at which link has sent data reserved
+        self._heartbeats = set()
+        self._stop = threading.Event()
+        self._set_mode(Mode.video)
+
+        self._http = _HTTPServer((host, port), _RequestHandler)
+        self._heartbeat = _HeartbeatServer(
+            (host, heartbeat_port), _HeartbeatHandler)
+        self._http.camera = self._heartbeat.camera = self
+        self.host = host
+        self.port = self._http.server_address[1]
+        self.heartbeat_port = self._heartbeat.server_address[1]
+
+    @property
+    def kwargs(self):
+        """Keyword arguments for connecting `YIDashcam` to this camera"""
+        return {'host': self.host, 'port': self.port,
+                'heartbeat_port': self.heartbeat_port}
+
+    def start(self):
+        """Start serving requests, in background threads"""
+        for server in (self._http, self._heartbeat):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        if self.clip_length:
+            threading.Thread(target=self._record_clips, daemon=True).start()
+
+    def stop(self):
+        """Stop serving requests, and close sockets"""
+        self._stop.set()
+        for server in (self._http, self._heartbeat):
+            server.shutdown()
+            server.server_close()
+        self.lose_connection()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def now(self):
+        """Time on the dashcam's clock"""
+        return (datetime.datetime.now()
+                + self._clock_offset).replace(microsecond=0)
+
+    def reserve_bandwidth(self, size):
+        """Reserve time to send `size` bytes over link shared by all
+        connections, returning delay before sending"""
+        with self._link_lock:
+            now = time.monotonic()
+            start = max(now, self._link_free)
+            self._link_free = start + size / self.bandwidth
+        return start - now
+
+    def add_file(self, path, size=0, content=None, time=None,
+                 read_only=None):
+        """Write file to the SD Card, at `time` (default: now)"""
+        if read_only is None:
+            read_only = _file_category(path) == 'emergency'
+        with self._lock:
+            self.files[path] = SimulatedFile(
+                size, time or self.now(), read_only, content)
+            self.total_use += 1
+
+    def lose_connection(self):
+        """Drop connection, as if WiFi lost, closing heartbeat sockets"""
+        with self._lock:
+            self.connected = False
+        for sock in list(self._heartbeats):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def respond(self, cmd, path="/", par=None, string=None):
+        """Content type and body of response to command `cmd`
+
+        Body is `None` if dashcam would reply "page not found"."""
+        with self._lock:
+            if cmd != Command.connect and not self.connected:
+                return "text/xml", _function_xml(cmd, STATUS_LOST_CONNECTION)
+            if cmd == Command.file_thumbnail:
+                if _card_path(path) in self.files:
+                    return "image/jpeg", _THUMBNAIL
+                return "text/html", None
+            elif cmd == Command.config:
+                return "text/xml", self._config_xml()
+            elif cmd == Command.card_info:
+                return "text/xml", self._card_info_xml()
+            elif cmd == Command.file_list and self.mode == Mode.file:
+                return "text/xml", self._file_list_xml()
+            try:
+                extra = self._command(cmd, par, string)
+            except _CommandFailed as err:
+                _LOG.debug("Command %s failed: %s", cmd, err.status)
+                return "text/xml", _function_xml(cmd, err.status)
+            return "text/xml", _function_xml(cmd, STATUS_OK, extra or "")
+
+    def _command(self, cmd, par, string):
+        if cmd == Command.connect:
+            self.connected = True
+        elif cmd == Command.disconnect:
+            self.connected = False
+        elif cmd == Command.mode:
+            try:
+                self._set_mode(Mode(par))
+            except ValueError:
+                raise _CommandFailed()
+        elif cmd == Command.clock:
+            try:
+                clock = datetime.datetime.strptime(
+                    string or "", "%Y-%m-%d_%H:%M:%S")
+            except ValueError:
+                raise _CommandFailed()
+            self._clock_offset = clock - datetime.datetime.now()
+        elif cmd == Command.video_state:
+            return "<Value>{}</Value>\n".format(int(self.recording))
+        elif cmd == Command.video_record:
+            if self.mode != Mode.video:
+                raise _CommandFailed()
+            if par and not self.recording:
+                self._start_recording()
+            elif not par and self.recording:
+                self._stop_recording()
+        elif cmd == Command.video_seconds_left:
+            used = sum(file.size for file in self.files.values())
+            return "<Value>{}</Value>\n".format(
+                max(self.capacity - used, 0) // VIDEO_RATE)
+        elif cmd == Command.video_stream:
+            pass
+        elif cmd == Command.video_emergency:
+            if not self.recording:
+                raise _CommandFailed()
+            self._save_clip(emergency=True)
+        elif cmd == Command.video_photo:
+            if not self.recording:
+                raise _CommandFailed()
+            self._save_photo()
+        elif cmd == Command.take_photo:
+            if self.mode != Mode.photo:
+                raise _CommandFailed()
+            path = self._save_photo()
+            return "<File>\n<NAME>{}</NAME>\n<FPATH>{}</FPATH>\n</File>\n" \
+                .format(ntpath.basename(path), path)
+        elif cmd in (Command.file_delete, Command.file_force_delete):
+            file = self.files.get(string)
+            if file is None or (file.read_only
+                                and cmd != Command.file_force_delete):
+                raise _CommandFailed()
+            del self.files[string]
+        else:
+            try:
+                option = Option(cmd)
+            except ValueError:
+                raise _CommandFailed()
+            self._set_config(option, par)
+
+    def _set_config(self, option, value):
+        if self.mode != Mode.video or self.recording \
+                or option_map[option] is str or value is None:
+            raise _CommandFailed()
+        try:
+            self.config[option] = option_map[option](value)
+        except ValueError:
+            raise _CommandFailed()
+
+    def _set_mode(self, mode):
+        if mode == self.mode:
+            return
+        if self.recording:
+            self._stop_recording()
+        self.mode = mode
+        if mode == Mode.video and self.config[Option.video_auto_start]:
+            self._start_recording()
+
+    def _start_recording(self):
+        self.recording = True
+        self._record_start = self.now()
+
+    def _stop_recording(self):
+        self._save_clip()
+        self.recording = False
+
+    def _save_clip(self, emergency=False):
+        """Save clip recorded so far, and start the next"""
+        now = self.now()
+        seconds = (now - self._record_start).total_seconds()
+        if seconds >= MIN_CLIP_SECONDS:
+            self._sequence += 1
+            path = "A:\\{}\\{:%Y_%m%d_%H%M%S}_{:04d}.MP4".format(
+                "EMR" if emergency else "Movie", self._record_start,
+                self._sequence)
+            size = int(seconds * VIDEO_RATE)
+            self.add_file(path, size, time=self._record_start)
+            if not emergency:
+                self.add_file(_companion_path(path), size // 10,
+                              time=self._record_start)
+        self._record_start = now
+
+    def _save_photo(self):
+        self._sequence += 1
+        path = "A:\\Photo\\{:%Y_%m%d_%H%M%S}_{:04d}.JPG".format(
+            self.now(), self._sequence)
+        self.add_file(path, PHOTO_SIZE)
+        return path
+
+    def _record_clips(self):
+        while not self._stop.wait(min(self.clip_length, 1)):
+            with self._lock:
+                if self.recording and (
+                        self.now() - self._record_start).total_seconds() \
+                        >= self.clip_length:
+                    self._save_clip()
+
+    def _config_xml(self):
+        entries = "".join(
+            "<Cmd>{}</Cmd>\n<Status>{}</Status>\n".format(
+                int(option), value if isinstance(value, str) else int(value))
+            for option, value in sorted(self.config.items()))
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<LIST>\n'
+                '{}</LIST>\n').format(entries).encode()
+
+    def _card_info_xml(self):
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<Function>\n'
+                '<CARDTYPE>SDHC</CARDTYPE>\n'
+                '<CARDWRITERATE>10</CARDWRITERATE>\n'
+                '<CARDCAPACITY>{}</CARDCAPACITY>\n'
+                '<CARDVENDOR>3</CARDVENDOR>\n'
+                '<CTNSLOWCARD>0</CTNSLOWCARD>\n'
+                '<AVGUSEDUR>0</AVGUSEDUR>\n'
+                '<CTNTOTALUSE>{}</CTNTOTALUSE>\n'
+                '</Function>\n').format(
+                    self.capacity // 1000000, self.total_use).encode()
+
+    def _file_list_xml(self):
+        entries = "".join(
+            "<File><NAME>{0}</NAME><FPATH>{1}</FPATH><SIZE>{2.size}</SIZE>"
+            "<TIMECODE>0</TIMECODE><TIME>{2.time:%Y/%m/%d %H:%M:%S}</TIME>"
+            "<ATTR>{3}</ATTR></File>\n".format(
+                ntpath.basename(path), path, file,
+                33 if file.read_only else 32)
+            for path, file in sorted(self.files.items()))
+        return ('<?xml version="1.0" encoding="UTF-8" ?>\n<LIST>\n<ALLFile>\n'
+                '{}</ALLFile>\n</LIST>\n').format(entries).encode()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="{}.simulator".format(__package__),
+        description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument('-p', dest='port', type=int, default=8080,
+                        help="HTTP port (default: 8080)")
+    parser.add_argument('--heartbeat-port', type=int, default=3333,
+                        help="heartbeat port (default: 3333)")
+    parser.add_argument('-f', dest='files', type=int, default=100,
+                        help="number of files on SD Card (default: 100)")
+    parser.add_argument('-s', dest='size', type=float, default=10,
+                        help="size of each file in MB (default: 10)")
+    parser.add_argument('--serial', default="SIM0000000001",
+                        help="serial number (default: SIM0000000001)")
+    parser.add_argument('--clip-length', type=float,
+                        help="seconds between clips saved while recording "
+                             "(default: only when recording stops)")
+    parser.add_argument('-l', dest='latency', type=float, default=0,
+                        help="latency of each request in ms (default: 0)")
+    parser.add_argument('-b', dest='bandwidth', type=float,
+                        help="bandwidth in MB/s (default: unlimited)")
+    for fault in ('drop', 'truncate', 'not_found', 'lost_connection'):
+        parser.add_argument(
+            '--{}'.format(fault.replace('_', '-')), dest=fault, type=float,
+            default=0, metavar="RATE",
+            help="probability of {} fault per request (default: 0)".format(
+                fault.replace('_', ' ')))
+    parser.add_argument('--seed', type=int,
+                        help="seed to make faults reproducible")
+    parser.add_argument('-v', dest='verbose', action='store_true',
+                        help="log requests and commands")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    camera = SimulatedCamera(
+        args.host, args.port, args.heartbeat_port,
+        files=synthetic_files(args.files, int(args.size * 1000000),
+                              time=datetime.datetime.now().replace(
+                                  microsecond=0) - datetime.timedelta(
+                                      minutes=args.files)),
+        serial_number=args.serial, clip_length=args.clip_length,
+        latency=args.latency / 1000,
+        bandwidth=args.bandwidth and args.bandwidth * 1000000,
+        faults=Faults(args.drop, args.truncate, args.not_found,
+                      args.lost_connection, args.seed))
+    with camera:
+        print("Simulated dashcam at http://{0.host}:{0.port}/ with heartbeat "
+              "on port {0.heartbeat_port}, Ctrl-C to stop".format(camera))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
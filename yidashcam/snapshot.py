@@ -0,0 +1,85 @@
+"""On-disk snapshots of YI Dashcam file list, for warm starts"""
+
+import datetime
+import json
+import logging
+import os
+import re
+import time
+
+from . import YIDashcamFile
+
+_LOG = logging.getLogger(__name__)
+
+#: Version of snapshot format, those of other versions are ignored
+SNAPSHOT_VERSION = 3
+
+#: Default time, in seconds, after which a snapshot isn't used
+SNAPSHOT_MAX_AGE = 24 * 60 * 60
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S"
+
+
+class SnapshotStore():
+    """Snapshots of dashcam file list, kept in `directory`
+
+    A snapshot is kept per dashcam, by serial number. As all dashcams share
+    the same address, the serial number is taken from the config fetched
+    from the dashcam on connecting, rather than trusting any saved for the
+    address. Each snapshot records the dashcam's SD Card info as it was
+    when the file list was fetched, including its type, vendor and
+    capacity, and a count of files written; the snapshot is only used if
+    this is unchanged, so the file list is fetched again once the card has
+    really changed. Files deleted by other means (e.g. the phone app), or
+    a card swapped for an identical one with the same count, aren't
+    noticed by this, so snapshots older than `max_age` seconds aren't used
+    either."""
+
+    def __init__(self, directory, max_age=SNAPSHOT_MAX_AGE):
+        self.directory = directory
+        self.max_age = max_age
+
+    def _path(self, serial_number):
+        return os.path.join(self.directory, "{}.json".format(
+            re.sub(r"[^\w.-]", "_", serial_number)))
+
+    def load(self, serial_number, card_info):
+        """List of files for dashcam with `serial_number`
+
+        Returns `None` if there is no snapshot for the dashcam, it is older
+        than `max_age`, or its `card_info` has changed since."""
+        try:
+            with open(self._path(serial_number)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            if snapshot['version'] != SNAPSHOT_VERSION \
+                    or time.time() - snapshot['saved'] > self.max_age \
+                    or snapshot['card_info'] != card_info:
+                return None
+            return [
+                YIDashcamFile(name, path, size,
+                              datetime.datetime.strptime(
+                                  file_time, _TIME_FORMAT),
+                              read_only)
+                for name, path, size, file_time, read_only
+                in snapshot['files']]
+        except (OSError, KeyError, TypeError, ValueError):
+            _LOG.debug("No usable snapshot for %s", serial_number,
+                       exc_info=True)
+            return None
+
+    def save(self, serial_number, card_info, files):
+        """Save list of `files` for dashcam with `serial_number`
+
+        `card_info` is the SD Card info from when the files were listed."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(serial_number)
+        with open("{}.tmp".format(path), 'w') as snapshot_file:
+            json.dump({
+                'version': SNAPSHOT_VERSION,
+                'saved': time.time(),
+                'card_info': card_info,
+                'files': [[file.name, file.path, file.size,
+                           file.time.strftime(_TIME_FORMAT), file.read_only]
+                          for file in files],
+            }, snapshot_file)
+        os.replace("{}.tmp".format(path), path)
@@ -0,0 +1,142 @@
+"""Incremental mirroring of YI Dashcam SD Card to a local directory"""
+
+import json
+import logging
+import os
+from collections import namedtuple
+
+from . import CATEGORIES, YIDashcamDeleteException, \
+    YIDashcamDownloadException, _companion_path
+
+_LOG = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".yidashcam-manifest.json"
+
+SyncResult = namedtuple(
+    'SyncResult', ['downloaded', 'unchanged', 'deleted', 'failed'])
+
+
+def _manifest_entry(file, local_path):
+    return {'size': file.size, 'time': file.time.isoformat(),
+            'local_path': local_path}
+
+
+def _copied(file, local_path):
+    """Whether `local_path` is a complete copy of `file`, going by size"""
+    try:
+        return os.path.getsize(local_path) == file.size
+    except OSError:
+        return False
+
+
+def load_manifest(dest_dir):
+    """Load manifest of files previously synced to `dest_dir`"""
+    try:
+        with open(os.path.join(dest_dir, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(dest_dir, manifest):
+    """Save manifest of files synced to `dest_dir`"""
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, MANIFEST_NAME)
+    with open("{}.tmp".format(path), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace("{}.tmp".format(path), path)
+
+
+def sync(yi, dest_dir, categories=CATEGORIES, delete=False, max_workers=2,
+         progress=None, limiter=None, catalog=None):
+    """Mirror files from dashcam `yi` into `dest_dir`
+
+    Files are placed in a sub-directory for each category. A manifest of
+    path, size and time of each file is kept in `dest_dir`, so only files
+    which are new or have changed since a previous sync, or whose local copy
+    is missing or not the size of the file, are downloaded. If `delete` is
+    true, files are deleted from the dashcam once their local copy has been
+    verified, by size. `max_workers`, `progress` and `limiter` are
+    passed to `YIDashcam.download_files`. If `catalog` is given, the file
+    list, local copies and deletions are recorded in the `Catalog`.
+
+    Returns a `SyncResult` of lists of files."""
+    manifest = load_manifest(dest_dir)
+    if catalog is not None:
+        serial_number = yi.serial_number
+        catalog.record_listing(serial_number, yi.file_list)
+    to_fetch = {}
+    unchanged = []
+    listed = set()
+    for category in categories:
+        category_dir = os.path.join(dest_dir, category)
+        for file in getattr(yi, '{}_list'.format(category)):
+            listed.add(file.path)
+            entry = manifest.get(file.path)
+            if entry is not None \
+                    and entry == _manifest_entry(file, entry['local_path']) \
+                    and _copied(
+                        file, os.path.join(dest_dir, entry['local_path'])):
+                unchanged.append(file)
+                if catalog is not None:
+                    catalog.record_download(
+                        serial_number, file,
+                        os.path.join(dest_dir, entry['local_path']))
+            else:
+                to_fetch.setdefault(category_dir, []).append(file)
+
+    downloaded = []
+    failed = {}
+    try:
+        for category_dir, files in to_fetch.items():
+            try:
+                paths = yi.download_files(files, category_dir,
+                                          max_workers=max_workers,
+                                          progress=progress,
+                                          limiter=limiter)
+            except YIDashcamDownloadException as err:
+                paths = err.downloaded
+                failed.update(err.failed)
+            for file, path in paths.items():
+                manifest[file.path] = _manifest_entry(
+                    file, os.path.relpath(path, dest_dir))
+                downloaded.append(file)
+                if catalog is not None:
+                    catalog.record_download(serial_number, file, path)
+    finally:
+        save_manifest(dest_dir, manifest)
+
+    deleted = []
+    if delete:
+        verified = {
+            file.path: file for file in unchanged + downloaded
+            if _copied(file, os.path.join(
+                dest_dir, manifest[file.path]['local_path']))}
+        # Companion "_s" clips are deleted along with their main clip, so
+        # only delete the main clip if its companion has also been copied
+        companions = {_companion_path(path) for path in verified}
+        to_delete = []
+        for file in verified.values():
+            companion = _companion_path(file.path)
+            if file.path in companions \
+                    or (companion in listed and companion not in verified):
+                continue
+            to_delete.append(file)
+        deleted_paths = []
+        # Read only (i.e. emergency) files must be force deleted
+        for force in (False, True):
+            files = [file for file in to_delete if file.read_only == force]
+            if not files:
+                continue
+            try:
+                deleted_paths.extend(yi.delete_files(files, force))
+            except YIDashcamDeleteException as err:
+                deleted_paths.extend(err.deleted)
+                failed.update((verified[path], error)
+                              for path, error in err.failed.items()
+                              if path in verified)
+        if catalog is not None:
+            catalog.record_deleted(serial_number, deleted_paths)
+        deleted = [verified[path] for path in deleted_paths
+                   if path in verified]
+    return SyncResult(downloaded, unchanged, deleted, failed)
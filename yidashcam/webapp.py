@@ -1,28 +1,79 @@
+from collections import deque
+import datetime
+import itertools
+import json
 from math import ceil
-from operator import attrgetter
+import logging
+import mimetypes
+import os.path
+import queue
+import tempfile
+import threading
 import time
 
-from flask import Flask, Response, abort, render_template, redirect, request, \
-    url_for
+from flask import Flask, Response, abort, jsonify, render_template, \
+    redirect, request, send_file, url_for
 from flask_bootstrap import Bootstrap
 
-from . import Mode, YIDashcam, YIDashcamException, \
-    YIDashcamConnectionException, YIDashcamFileException
+from . import CATEGORIES, DOWNLOAD_CHUNK_SIZE, Mode, Priority, YIDashcam, \
+    YIDashcamException, YIDashcamConnectionException, \
+    YIDashcamDeleteException, YIDashcamFileException, _companion_path
+from .cache import ThumbnailCache
+from .catalog import Catalog, parse_time
 from .config import option_map
+from .metrics import Metrics
+from .snapshot import SnapshotStore
 
 app = Flask(__name__.split(".")[0])
 Bootstrap(app)
 app.config['BOOTSTRAP_SERVE_LOCAL'] = True
+app.config['THUMBNAIL_CACHE_DIR'] = os.path.join(
+    tempfile.gettempdir(), "yidashcam-thumbnails")
+app.config['THUMBNAIL_CACHE_SIZE'] = 64 * 1024 * 1024
+app.config['THUMBNAIL_PREFETCH'] = True
+app.config['THUMBNAIL_PREFETCH_QUEUE'] = 100
+app.config['FILES_PER_PAGE'] = 20
+# Seconds between polls of the file list, while anyone is watching for events
+app.config['FILE_WATCH_INTERVAL'] = 10
+# Polls after which the whole file list is fetched, even if card unchanged
+app.config['FILE_WATCH_FULL_REFRESH'] = 6
+# Seconds between comments sent to keep event streams open
+app.config['EVENTS_KEEPALIVE'] = 15
+# Directories to serve files from where already downloaded (e.g. by sync)
+app.config['LOCAL_FILE_DIRS'] = []
+# Collect metrics on dashcam requests, served at /metrics
+app.config['METRICS'] = True
+# SQLite catalog to record file lists in, and browse history from
+app.config['CATALOG'] = None
+# Directory to keep snapshots of dashcam file list in
+app.config['SNAPSHOT_DIR'] = None
 yi = None
+_yi_lock = threading.Lock()
+metrics = Metrics()
+thumbnail_cache = None
+thumbnail_prefetcher = None
+file_watcher = None
+catalog = None
+_catalog_tag = None  # Tag of file index last recorded in catalog
+
+_LOG = logging.getLogger(__name__)
 
 
 class Pagination():
-    """Derived from http://flask.pocoo.org/snippets/44/"""
+    """Derived from http://flask.pocoo.org/snippets/44/
+
+    Page can start at any `offset` into the items, rather than only at
+    multiples of `per_page`, in which case `page` is the page that `offset`
+    falls on. `prev_cursor` and `next_cursor` can be set to identify the
+    first item of the previous and next pages."""
 
-    def __init__(self, page, per_page, total_count):
+    def __init__(self, page, per_page, total_count, offset=None):
         self.page = page
         self.per_page = per_page
         self.total_count = total_count
+        self.offset = (page - 1) * per_page if offset is None else offset
+        self.prev_cursor = None
+        self.next_cursor = None
         if page < 1 or page > self.pages:
             raise ValueError("Invalid page number")
 
@@ -32,28 +83,191 @@ class Pagination():
 
     @property
     def has_prev(self):
-        return self.page > 1
+        return self.offset > 0
 
     @property
     def has_next(self):
-        return self.page < self.pages
+        return self.offset + self.per_page < self.total_count
 
     @property
     def first_item_index(self):
-        return (self.page - 1) * self.per_page
+        return self.offset
 
     @property
     def last_item_index(self):
-        if self.page == self.pages:
-            return self.total_count
-        else:
-            return self.page * self.per_page
+        return min(self.offset + self.per_page, self.total_count)
 
     def page_items(self, items):
         """Return list of items on current page from `items`"""
         return items[self.first_item_index:self.last_item_index]
 
 
+class ThumbnailPrefetcher():
+    """Warm thumbnail cache in a background thread while dashcam is idle
+
+    Interactive requests should be wrapped in `interactive()`; prefetching
+    pauses while any are in progress, and until `idle_delay` seconds after
+    the last one. At most `max_queue` thumbnails are waiting to be fetched,
+    and each call to `prefetch` replaces those still waiting."""
+
+    def __init__(self, max_queue=100, idle_delay=0.5):
+        self.idle_delay = idle_delay
+        self._queue = deque(maxlen=max_queue)
+        self._active = 0
+        self._last_active = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="ThumbnailPrefetcher", daemon=True)
+        self._thread.start()
+
+    def prefetch(self, files):
+        """Queue thumbnails of `files` for fetching, in order given"""
+        with self._condition:
+            self._queue.clear()
+            self._queue.extend(
+                file for file in files if file not in get_thumbnail_cache())
+            # Give browser chance to request thumbnails for current page
+            self._last_active = time.monotonic()
+            self._condition.notify()
+
+    def interactive(self):
+        """Context manager to pause prefetching during a request"""
+        return _InteractiveRequest(self)
+
+    def _wait_for_idle(self):
+        while True:
+            remaining = self._last_active + self.idle_delay - time.monotonic()
+            if self._queue and not self._active and remaining <= 0:
+                return self._queue.popleft()
+            self._condition.wait(
+                remaining if self._queue and not self._active else None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                file = self._wait_for_idle()
+            if yi is None or not yi.connected or yi.mode != Mode.file:
+                continue  # Don't disturb dashcam if in use for other things
+            try:
+                with yi.priority(Priority.background):
+                    get_thumbnail_cache().fetch(yi, file)
+            except YIDashcamException:
+                _LOG.debug("Failed to prefetch thumbnail for %s", file.path,
+                           exc_info=True)
+
+
+class _InteractiveRequest():
+    def __init__(self, prefetcher):
+        self.prefetcher = prefetcher
+
+    def __enter__(self):
+        with self.prefetcher._condition:
+            self.prefetcher._active += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.prefetcher._condition:
+            self.prefetcher._active -= 1
+            self.prefetcher._last_active = time.monotonic()
+            self.prefetcher._condition.notify()
+
+
+class FileWatcher():
+    """Poll dashcam file list in a background thread while anyone subscribes
+
+    Each subscriber gets a queue of events for changes to the file list, as
+    tuples of event name and data: "files" with the `version`, and files
+    `added` and paths `removed` since the last event; or "reset" if the
+    list was replaced, so should be fetched again. However many
+    subscribers there are, the dashcam is polled at most once every
+    `interval` seconds, at background priority. Polling mostly only
+    fetches the SD Card info, with the file list fetched again once this
+    changes. The card info counts files written, but not those deleted, so
+    the file list is also fetched every `full_refresh` polls, for changes
+    made other than via this app to be noticed."""
+
+    def __init__(self, interval=10, full_refresh=6):
+        self.interval = interval
+        self.full_refresh = full_refresh
+        self._subscribers = set()
+        self._condition = threading.Condition()
+        self._check_lock = threading.Lock()
+        self._tag = None
+        self._card_info = None  # When file list last fetched
+        self._polls = 0  # Since file list last fetched
+        self._thread = threading.Thread(
+            target=self._run, name="FileWatcher", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, since=None):
+        """Queue of events, starting with changes since version `since`"""
+        subscriber = queue.Queue()
+        if since is not None and yi is not None and yi.connected:
+            event = self._event(yi.file_index, since)
+            if event is not None:
+                subscriber.put(event)
+        with self._condition:
+            self._subscribers.add(subscriber)
+            self._condition.notify()
+        self.check()  # So changes from now on are sent
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Stop sending events to `subscriber`"""
+        with self._condition:
+            self._subscribers.discard(subscriber)
+
+    @staticmethod
+    def _event(file_index, since):
+        tag = file_index.tag
+        if since == tag:
+            return None
+        changes = file_index.changes_since(since)
+        if changes is None:
+            return 'reset', {'version': tag}
+        return 'files', {'version': tag,
+                         'added': [file_json(file) for file in changes[0]],
+                         'removed': changes[1]}
+
+    def check(self):
+        """Send subscribers any changes to cached file list since last check
+
+        Doesn't fetch the file list, so can be called after changing it."""
+        if yi is None or not yi.connected:
+            return
+        with self._check_lock:
+            file_index = yi.file_index
+            if self._tag is None:
+                event = None  # Nothing sent yet, so no changes to send
+            else:
+                event = self._event(file_index, self._tag)
+            self._tag = file_index.tag
+        if event is not None:
+            with self._condition:
+                for subscriber in self._subscribers:
+                    subscriber.put(event)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._subscribers:
+                    self._condition.wait()
+            if yi is not None and yi.connected and yi.mode == Mode.file:
+                # Otherwise, don't disturb dashcam if in use for other things
+                try:
+                    with yi.priority(Priority.background):
+                        card_info = yi.card_info
+                        self._polls += 1
+                        if card_info != self._card_info \
+                                or self._polls >= self.full_refresh:
+                            yi.refresh_file_list()
+                            self._card_info = card_info
+                            self._polls = 0
+                    self.check()
+                except YIDashcamException:
+                    _LOG.debug("Failed to poll file list", exc_info=True)
+            time.sleep(self.interval)
+
+
 def url_for_other_page(page):
     """http://flask.pocoo.org/snippets/44/"""
     args = request.view_args.copy()
@@ -61,51 +275,168 @@ def url_for_other_page(page):
     return url_for(request.endpoint, **args)
 
 
+def url_for_cursor(cursor):
+    """URL of page of current file type starting from `cursor`"""
+    return url_for(request.endpoint, file_type=request.view_args['file_type'],
+                   **{'from': cursor})
+
+
 app.jinja_env.globals['url_for_other_page'] = url_for_other_page
+app.jinja_env.globals['url_for_cursor'] = url_for_cursor
+
+
+def file_cursor(file):
+    """Cursor identifying position of `file` in list, by time and path
+
+    Unlike page numbers, this doesn't shift as files are added or deleted."""
+    return "{:%Y%m%d%H%M%S}{}".format(file.time, file.url_path)
+
+
+def parse_cursor(cursor):
+    """Time and dashcam path from `cursor`, raising `ValueError` if invalid
+    """
+    return (datetime.datetime.strptime(cursor[:14], "%Y%m%d%H%M%S"),
+            camera_path(cursor[15:]))
 
 
 def get_yi():
     global yi
-    if yi is None:
-        yi = YIDashcam(Mode.file)
-    elif not yi.connected:
-        yi.connect(mode=Mode.file)
-    elif yi.mode != Mode.file:
-        yi.set_mode(Mode.file)
-    return yi
+    with _yi_lock:  # Requests are handled concurrently
+        if yi is None:
+            yi = YIDashcam(
+                Mode.file, metrics=metrics if app.config['METRICS'] else None,
+                snapshot=SnapshotStore(app.config['SNAPSHOT_DIR'])
+                if app.config['SNAPSHOT_DIR'] else None)
+        elif not yi.connected:
+            yi.connect(mode=Mode.file)
+        elif yi.mode != Mode.file:
+            yi.set_mode(Mode.file)
+        return yi
+
+
+def get_thumbnail_cache():
+    global thumbnail_cache
+    if thumbnail_cache is None:
+        thumbnail_cache = ThumbnailCache(app.config['THUMBNAIL_CACHE_DIR'],
+                                         app.config['THUMBNAIL_CACHE_SIZE'])
+    return thumbnail_cache
+
+
+def get_thumbnail_prefetcher():
+    global thumbnail_prefetcher
+    if thumbnail_prefetcher is None:
+        thumbnail_prefetcher = ThumbnailPrefetcher(
+            app.config['THUMBNAIL_PREFETCH_QUEUE'])
+    return thumbnail_prefetcher
+
+
+def get_catalog():
+    """`Catalog`, or `None` if not configured"""
+    global catalog
+    if catalog is None and app.config['CATALOG']:
+        catalog = Catalog(app.config['CATALOG'])
+    return catalog
+
+
+def get_file_index():
+    """File index of dashcam, recorded in catalog (if any) when changed
+
+    Only changes since last recorded are recorded, unless the index has been
+    replaced, in which case the whole listing is."""
+    global _catalog_tag
+    yi = get_yi()
+    file_index = yi.file_index
+    if get_catalog() is not None:
+        tag = file_index.tag
+        if tag != _catalog_tag:
+            changes = None
+            if _catalog_tag is not None:
+                changes = file_index.changes_since(_catalog_tag)
+            if changes is None:
+                catalog.record_listing(yi.serial_number, file_index.files())
+            else:
+                catalog.record_changes(yi.serial_number, *changes)
+            _catalog_tag = tag
+    return file_index
+
+
+def get_file_watcher():
+    global file_watcher
+    if file_watcher is None:
+        file_watcher = FileWatcher(app.config['FILE_WATCH_INTERVAL'],
+                                   app.config['FILE_WATCH_FULL_REFRESH'])
+    return file_watcher
+
+
+def prefetch_thumbnails(file_type, file_index, pagination):
+    """Prefetch thumbnails for pages adjacent to current one, and first page
+    of other file types"""
+    if not app.config['THUMBNAIL_PREFETCH']:
+        return
+    per_page = pagination.per_page
+    files = file_index.latest(per_page, file_type,
+                              pagination.offset + per_page)
+    if pagination.has_prev:
+        files.extend(file_index.latest(
+            per_page, file_type, max(pagination.offset - per_page, 0)))
+    for category in CATEGORIES:
+        if category != file_type:
+            files.extend(file_index.latest(per_page, category))
+    get_thumbnail_prefetcher().prefetch(files)
+
+
+def camera_path(path):
+    """Convert URL path to path on dashcam SD Card"""
+    return "A:\\{}".format(path.replace('/', '\\'))
+
+
+def error_page(message, status, detail=None):
+    """Error page, or error as JSON for API requests"""
+    if request.path.startswith("/api/"):
+        error = {'message': str(message)}
+        if detail is not None:
+            error['detail'] = str(detail)
+        return jsonify(error=error), status
+    return render_template(
+        "error.html", message=message, detail=detail), status
 
 
 @app.errorhandler(404)
 def error_404_handler(error):
-    return render_template("error.html", message=error), 404
+    return error_page(error, 404)
 
 
 @app.errorhandler(500)
 def error_500_handler(error):
-    return render_template("error.html", message=error), 500
+    return error_page(error, 500)
 
 
 @app.errorhandler(YIDashcamException)
 def yi_handler(error):
-    return render_template(
-        "error.html", message="Error Interfacing With YI Dashcam"), 500
+    return error_page("Error Interfacing With YI Dashcam", 500, error)
 
 
 @app.errorhandler(YIDashcamConnectionException)
 def yi_connection_handler(error):
-    return render_template(
-        "error.html", message="Failed To Connect To YI Dashcam"), 500
+    return error_page("Failed To Connect To YI Dashcam", 500)
 
 
 @app.errorhandler(YIDashcamFileException)
 def yi_file_handler(error):
-    return render_template(
-        "error.html", message="File Not Found On YI Dashcam"), 404
+    return error_page("File Not Found On YI Dashcam", 404)
+
+
+@app.errorhandler(YIDashcamDeleteException)
+def yi_delete_handler(error):
+    return error_page(
+        "Failed To Delete {} Files From YI Dashcam".format(len(error.failed)),
+        500, "; ".join("{}: {}".format(path, err)
+                       for path, err in error.failed.items()))
 
 
 @app.context_processor
 def yi_context():
-    context = {}
+    context = {'catalog_enabled': get_catalog() is not None}
     if yi is not None and yi.connected:
         context['serial_number'] = yi.serial_number
         context['firmware_version'] = yi.firmware_version
@@ -120,55 +451,361 @@ def index():
 @app.route('/<file_type>/', defaults={'page': 1})
 @app.route('/<file_type>/<int:page>')
 def file_list_page(file_type, page):
-    try:
-        file_list = getattr(get_yi(), '{}_list'.format(file_type))
-    except AttributeError:
+    """Page of files, newest first, by page number or from a cursor
+
+    Pages are sliced from the file index, already sorted by time, rather
+    than sorting the whole list for each page."""
+    if file_type not in CATEGORIES:
         abort(404)
-    file_list_len = len(file_list) if file_list is not None else 1
+    file_index = get_file_index()
+    per_page = app.config['FILES_PER_PAGE']
+    count = file_index.count(file_type)
+    cursor = request.args.get('from')
+    if cursor is not None:
+        try:
+            offset = file_index.rank(*parse_cursor(cursor),
+                                     category=file_type)
+        except ValueError:
+            abort(404)  # Bad cursor
+        # Files from cursor onwards may have since been deleted
+        offset = min(offset, max(count - 1, 0) // per_page * per_page)
+        page = offset // per_page + 1
+    else:
+        offset = None
     try:
-        pagination = Pagination(page, 20, file_list_len)
+        pagination = Pagination(page, per_page, count, offset)
     except ValueError:
         # Bad page number
         abort(404)
 
-    file_list.sort(key=attrgetter('time'), reverse=True)
-    page_file_list = pagination.page_items(file_list)
+    page_file_list = file_index.latest(
+        per_page, file_type, pagination.offset)
+    if pagination.has_prev:
+        pagination.prev_cursor = file_cursor(file_index.latest(
+            1, file_type, max(pagination.offset - per_page, 0))[0])
+    if pagination.has_next:
+        pagination.next_cursor = file_cursor(file_index.latest(
+            1, file_type, pagination.offset + per_page)[0])
+    prefetch_thumbnails(file_type, file_index, pagination)
     return render_template(
         'file_list.html',
         file_type=file_type,
         file_list=page_file_list,
         file_dates={file_.time.date() for file_ in page_file_list},
-        pagination=pagination)
+        pagination=pagination,
+        cursor=file_cursor(page_file_list[0]) if page_file_list else None,
+        page_url=url_for_cursor(file_cursor(page_file_list[0]))
+        if pagination.has_prev else url_for(
+            'file_list_page', file_type=file_type))
 
 
 @app.route('/thumbnail/<path:path>')
 def thumbnail(path):
-    """Fetch thumbnail, and ask browser to cache for a week"""
-    return Response(
-        get_yi().get_thumbnail(path),
-        headers={'Cache-Control': "max-age=604800"},
-        mimetype='image/jpeg')
+    """Fetch thumbnail, via server side cache, and ask browser to cache for a
+    week"""
+    headers = {'Cache-Control': "max-age=604800"}
+    file = get_yi().file_index.get(camera_path(path))
+    if file is None:
+        return Response(
+            get_yi().get_thumbnail(path), headers=headers,
+            mimetype='image/jpeg')
+
+    response = Response(headers=headers, mimetype='image/jpeg')
+    response.set_etag(ThumbnailCache.key(file))
+    response.last_modified = file.time
+    response.make_conditional(request)
+    if response.status_code != 304:
+        with get_thumbnail_prefetcher().interactive():
+            response.set_data(get_thumbnail_cache().fetch(get_yi(), file))
+    return response
+
+
+def local_file_path(file):
+    """Path of local copy of dashcam `file`, or `None` if not found"""
+    for local_dir in app.config['LOCAL_FILE_DIRS']:
+        for local_path in (os.path.join(local_dir, file.category, file.name),
+                           os.path.join(local_dir, file.name)):
+            try:
+                if os.path.getsize(local_path) == file.size:
+                    return local_path
+            except OSError:
+                pass
+    return None
+
+
+@app.route('/video/<path:path>')
+def video(path):
+    """Stream video (or other file) from dashcam, with HTTP Range support
+
+    Served from a local copy instead if one is found"""
+    file = get_yi().file_index.get(camera_path(path))
+    if file is None:
+        abort(404)
+    mimetype = mimetypes.guess_type(file.name)[0] or 'video/mp4'
+    local_path = local_file_path(file)
+    if local_path is not None:
+        return send_file(local_path, mimetype=mimetype, conditional=True)
+
+    headers = {'Accept-Ranges': "bytes"}
+    byte_range = None
+    if request.range is not None:
+        byte_range = request.range.range_for_length(file.size)
+        if byte_range is None and len(request.range.ranges) == 1:
+            headers['Content-Range'] = "bytes */{}".format(file.size)
+            return Response(status=416, headers=headers)
+    if byte_range is None:
+        # Multiple ranges aren't supported, so whole file is served instead
+        start, stop, status = 0, file.size, 200
+    else:
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = "bytes {}-{}/{}".format(
+            start, stop - 1, file.size)
+    headers['Content-Length'] = str(stop - start)
+
+    data = get_yi().get_file(file, start, stop - 1, DOWNLOAD_CHUNK_SIZE)
+
+    def stream():
+        with get_thumbnail_prefetcher().interactive():
+            yield from data
+
+    return Response(stream(), status, headers, mimetype=mimetype,
+                    direct_passthrough=True)
+
+
+@app.route('/metrics')
+def metrics_page():
+    """Metrics on dashcam requests, in Prometheus text format"""
+    if not app.config['METRICS']:
+        abort(404)
+    return Response(metrics.prometheus(),
+                    mimetype="text/plain; version=0.0.4")
+
+
+def file_json(file):
+    """Properties of `file` for JSON"""
+    return {'name': file.name, 'path': file.path, 'url_path': file.url_path,
+            'size': file.size, 'time': file.time.isoformat(),
+            'read_only': file.read_only, 'category': file.category}
+
+
+def config_json(value):
+    """Config `value` for JSON, using names of enum values"""
+    return value if isinstance(value, (bool, str)) else value.name
+
+
+@app.route('/api/files', defaults={'file_type': None})
+@app.route('/api/files/<file_type>')
+def api_files(file_type):
+    """List of files (optionally of one file type) as JSON, oldest first
+
+    The ETag is the `version` of the cached file list, so polling with
+    If-None-Match gets "304 Not Modified" without a request to the dashcam
+    until the list changes. With `since` set to a previous `version`, only
+    files `added` (or changed) and paths `removed` since then are returned,
+    unless they are no longer known, in which case all `files` are."""
+    if file_type is not None and file_type not in CATEGORIES:
+        abort(404)
+    file_index = get_file_index()
+    tag = file_index.tag
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
+    else:
+        body = {'version': tag}
+        since = request.args.get('since')
+        changes = None
+        if since is not None:
+            changes = file_index.changes_since(since, file_type)
+        if changes is None:
+            body['files'] = [
+                file_json(file) for file in file_index.files(file_type)]
+        else:
+            body['since'] = since
+            body['added'] = [file_json(file) for file in changes[0]]
+            body['removed'] = changes[1]
+        response = jsonify(body)
+    response.set_etag(tag)
+    response.cache_control.no_cache = True  # Always check version
+    return response
+
+
+@app.route('/api/card_info')
+def api_card_info():
+    """Information of SD Card in dashcam as JSON"""
+    return jsonify(get_yi().card_info)
+
+
+@app.route('/api/config')
+def api_config():
+    """Dashcam config as JSON, by option name"""
+    return jsonify({option.name: config_json(value)
+                    for option, value in get_yi().config.items()})
+
+
+@app.route('/api/events')
+def api_events():
+    """Changes to file list as server-sent events (see `FileWatcher`)
+
+    Event IDs are the file list `version`, so on reconnecting, changes
+    missed since are sent first."""
+    watcher = get_file_watcher()
+    subscriber = watcher.subscribe(request.headers.get('Last-Event-ID'))
+    keepalive = app.config['EVENTS_KEEPALIVE']
+
+    def stream():
+        try:
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "event: {}\nid: {}\ndata: {}\n\n".format(
+                    event, data['version'], json.dumps(data))
+        finally:
+            watcher.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={'Cache-Control': "no-cache"})
+
+
+def delete_paths(paths):
+    """Delete files from dashcam (with companions), and their thumbnails"""
+    # Look up files first, as thumbnails are cached by file, not path
+    file_index = get_yi().file_index
+    files = {}
+    for path in itertools.chain(paths, map(_companion_path, paths)):
+        file = file_index.get(path or "")
+        if file is not None:
+            files[path] = file
+    deleted = []
+    try:
+        deleted = get_yi().delete_files(paths, force=True)
+    except YIDashcamDeleteException as err:
+        deleted = err.deleted
+        raise
+    finally:
+        for path in deleted:
+            if path in files:
+                get_thumbnail_cache().discard(files[path])
+        if file_watcher is not None:
+            file_watcher.check()
+
+
+@app.route('/delete', methods=["POST"])
+def delete_selected():
+    """Delete files selected on file list page from dashcam"""
+    delete_paths([camera_path(path.lstrip("/"))
+                  for path in request.form.getlist("path")])
+    return redirect(request.form.get("next", request.referrer), code=303)
 
 
 @app.route('/delete/<path:path>', methods=["POST"])
 def delete(path):
     """Delete file from dashcam"""
-    path = "A:\\{}".format(path.replace('/', '\\'))
-    get_yi().delete_file(path, force=True)
+    delete_paths([camera_path(path)])
     return redirect(request.form.get("next", request.referrer), code=303)
 
 
+def history_filters():
+    """Filters for catalog from request arguments, aborting if invalid"""
+    try:
+        return {
+            'serial_number': request.args.get('serial') or None,
+            'category': request.args.get('category') or None,
+            'start': parse_time(request.args['from'])
+            if request.args.get('from') else None,
+            'end': parse_time(request.args['to'], end=True)
+            if request.args.get('to') else None,
+            'local': True if request.args.get('local') else None,
+        }
+    except ValueError:
+        abort(404)  # Bad time
+
+
+def url_for_history_page(page):
+    """URL of other page of history, with same filters"""
+    args = request.args.to_dict()
+    args['page'] = page
+    return url_for('history', **args)
+
+
+app.jinja_env.globals['url_for_history_page'] = url_for_history_page
+
+
+@app.route('/history')
+def history():
+    """Page of files recorded in catalog, newest first
+
+    Doesn't need a connection to the dashcam."""
+    if get_catalog() is None:
+        abort(404)
+    filters = history_filters()
+    per_page = app.config['FILES_PER_PAGE']
+    try:
+        pagination = Pagination(request.args.get('page', 1, type=int),
+                                per_page, catalog.count(**filters))
+    except ValueError:
+        # Bad page number
+        abort(404)
+    return render_template(
+        'history.html',
+        entries=catalog.files(limit=per_page, offset=pagination.offset,
+                              **filters),
+        serial_numbers=catalog.serial_numbers(),
+        categories=CATEGORIES,
+        connected_serial_number=yi.serial_number
+        if yi is not None and yi.connected else None,
+        pagination=pagination)
+
+
+@app.route('/history/file/<int:entry_id>')
+def history_file(entry_id):
+    """Local copy of file recorded in catalog"""
+    if get_catalog() is None:
+        abort(404)
+    entry = catalog.get(entry_id)
+    if entry is None or entry.local_path is None \
+            or not os.path.isfile(entry.local_path):
+        abort(404)
+    return send_file(
+        entry.local_path, conditional=True,
+        mimetype=mimetypes.guess_type(entry.file.name)[0] or 'video/mp4')
+
+
+@app.route('/api/history')
+def api_history():
+    """Files recorded in catalog as JSON, newest first
+
+    Takes the same filters as the history page, plus `limit` and
+    `offset`."""
+    if get_catalog() is None:
+        abort(404)
+    entries = catalog.files(
+        limit=request.args.get('limit', type=int),
+        offset=request.args.get('offset', 0, type=int),
+        **history_filters())
+    return jsonify(files=[dict(
+        file_json(entry.file), id=entry.id,
+        serial_number=entry.serial_number,
+        first_seen=entry.first_seen.isoformat(),
+        last_seen=entry.last_seen.isoformat(), on_camera=entry.on_camera,
+        local_path=entry.local_path,
+        downloaded=entry.downloaded and entry.downloaded.isoformat())
+        for entry in entries])
+
+
 @app.route('/settings', methods=["GET", "POST"])
 def settings():
     """Page to interact with dashcam config"""
     if request.method == "POST":
         yi = get_yi()
+        changes = {}
         for option, cur_value in yi.config.items():
             new_value = request.form.get(option.name, None)
             if new_value is not None and int(new_value) != cur_value:
-                yi.set_config(option, int(new_value))
-        yi.set_mode(Mode.file)
-        time.sleep(0.5)  # Allow settings to settle in
+                changes[option] = int(new_value)
+        yi.apply_config(changes)  # Returns dashcam to file mode
         return redirect(url_for('settings'), code=303)
     else:
         return render_template(